@@ -6,11 +6,23 @@
  * of sequences.
  **/
 
+#include <algorithm>
+#include <atomic>
+#include <chrono>
+#include <condition_variable>
+#include <exception>
 #include <fstream>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <numeric>
+#include <pybind11/numpy.h>
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
 #include <random>
 #include <sstream>
+#include <stdexcept>
+#include <thread>
 
 #include "meta/io/filesystem.h"
 #include "meta/logging/logger.h"
@@ -74,6 +86,487 @@ struct type_caster<meta::util::identifier<Tag, T>>
 } // namespace detail
 } // namespace pybind11
 
+/**
+ * The xoroshiro128+ generator from meta::random, extended with the jump
+ * function from the reference implementation so that non-overlapping
+ * streams can be split off of one seed. It produces the same sequence as
+ * meta::random::xoroshiro128 for the same seed.
+ *
+ * @see http://xoroshiro.di.unimi.it/xoroshiro128plus.c
+ */
+class xoroshiro128
+{
+  public:
+    using result_type = uint64_t;
+
+    explicit xoroshiro128(uint64_t value)
+    {
+        random::splitmix64 sm{value};
+        s0_ = sm();
+        s1_ = sm();
+    }
+
+    xoroshiro128(uint64_t s1, uint64_t s2) : s0_{s1}, s1_{s2}
+    {
+        // nothing
+    }
+
+    static constexpr uint64_t min()
+    {
+        return 0;
+    }
+
+    static constexpr uint64_t max()
+    {
+        return std::numeric_limits<uint64_t>::max();
+    }
+
+    uint64_t operator()()
+    {
+        const auto s0 = s0_;
+        auto s1 = s1_;
+        const auto result = s0 + s1;
+
+        s1 ^= s0;
+        s0_ = rotl(s0, 55) ^ s1 ^ (s1 << 14);
+        s1_ = rotl(s1, 36);
+
+        return result;
+    }
+
+    /**
+     * Advances the generator by 2^64 steps, which is equivalent to that
+     * many calls to operator().
+     */
+    void jump()
+    {
+        static const uint64_t jump_polynomial[]
+            = {0xbeac0467eba5facbULL, 0xd86b048b86aa9922ULL};
+
+        uint64_t s0 = 0;
+        uint64_t s1 = 0;
+        for (const auto& word : jump_polynomial)
+        {
+            for (int b = 0; b < 64; ++b)
+            {
+                if (word & (1ULL << b))
+                {
+                    s0 ^= s0_;
+                    s1 ^= s1_;
+                }
+                (*this)();
+            }
+        }
+        s0_ = s0;
+        s1_ = s1;
+    }
+
+  private:
+    static uint64_t rotl(uint64_t x, int k)
+    {
+        return (x << k) | (x >> (64 - k));
+    }
+
+    uint64_t s0_;
+    uint64_t s1_;
+};
+
+/**
+ * A read-only view of training data stored in compressed sparse row form
+ * in four flat arrays, so that it can be handed over from NumPy without
+ * building a Session object per session or copying it into nested
+ * vectors.
+ *
+ * The sessions of user i are sessions user_offsets[i] up to (but not
+ * including) user_offsets[i + 1], and the (action, count) pairs of
+ * session s are entries session_offsets[s] up to session_offsets[s + 1]
+ * of action_ids and counts.
+ *
+ * It mimics the interface of a dm_mixture_model::training_data_type:
+ * training[i][j] is the j-th session of user i, and iterating over it
+ * yields (action, count) pairs.
+ */
+class csr_training_data
+{
+  public:
+    class session
+    {
+      public:
+        class iterator
+        {
+          public:
+            iterator(const uint64_t* action, const uint64_t* count)
+                : action_{action}, count_{count}
+            {
+                // nothing
+            }
+
+            std::pair<action_type, uint64_t> operator*() const
+            {
+                return {action_type{*action_}, *count_};
+            }
+
+            iterator& operator++()
+            {
+                ++action_;
+                ++count_;
+                return *this;
+            }
+
+            bool operator!=(const iterator& other) const
+            {
+                return action_ != other.action_;
+            }
+
+          private:
+            const uint64_t* action_;
+            const uint64_t* count_;
+        };
+
+        session(const csr_training_data& data, uint64_t idx)
+            : data_(data), idx_{idx}
+        {
+            // nothing
+        }
+
+        iterator begin() const
+        {
+            auto offset = data_.session_offsets_[idx_];
+            return {data_.action_ids_ + offset, data_.counts_ + offset};
+        }
+
+        iterator end() const
+        {
+            auto offset = data_.session_offsets_[idx_ + 1];
+            return {data_.action_ids_ + offset, data_.counts_ + offset};
+        }
+
+      private:
+        const csr_training_data& data_;
+        uint64_t idx_;
+    };
+
+    class user
+    {
+      public:
+        user(const csr_training_data& data, uint64_t idx)
+            : data_(data), idx_{idx}
+        {
+            // nothing
+        }
+
+        uint64_t size() const
+        {
+            return data_.user_offsets_[idx_ + 1] - data_.user_offsets_[idx_];
+        }
+
+        session operator[](uint64_t j) const
+        {
+            return {data_, data_.user_offsets_[idx_] + j};
+        }
+
+      private:
+        const csr_training_data& data_;
+        uint64_t idx_;
+    };
+
+    using array_type
+        = py::array_t<uint64_t, py::array::c_style | py::array::forcecast>;
+
+    /**
+     * Wraps the given arrays, which must outlive the view. Arrays that
+     * are already contiguous uint64 arrays are used in place; anything
+     * else is converted once, in bulk, by NumPy.
+     */
+    csr_training_data(const array_type& user_offsets,
+                      const array_type& session_offsets,
+                      const array_type& action_ids, const array_type& counts,
+                      uint64_t num_actions)
+        : user_offsets_{user_offsets.data()},
+          session_offsets_{session_offsets.data()},
+          action_ids_{action_ids.data()},
+          counts_{counts.data()},
+          num_users_{static_cast<uint64_t>(user_offsets.size()) - 1},
+          num_sessions_{static_cast<uint64_t>(session_offsets.size()) - 1}
+    {
+        if (user_offsets.size() < 1 || session_offsets.size() < 1)
+            throw std::invalid_argument{"offset arrays must not be empty"};
+        if (user_offsets_[0] != 0 || user_offsets_[num_users_] != num_sessions_)
+            throw std::invalid_argument{
+                "user_offsets must run from 0 to the number of sessions"};
+        if (action_ids.size() != counts.size())
+            throw std::invalid_argument{
+                "action_ids and counts must be the same length"};
+        if (session_offsets_[0] != 0
+            || session_offsets_[num_sessions_]
+                   != static_cast<uint64_t>(action_ids.size()))
+            throw std::invalid_argument{
+                "session_offsets must run from 0 to the number of entries"};
+
+        for (uint64_t i = 0; i < num_users_; ++i)
+        {
+            if (user_offsets_[i] > user_offsets_[i + 1])
+                throw std::invalid_argument{"user_offsets must not decrease"};
+        }
+        for (uint64_t s = 0; s < num_sessions_; ++s)
+        {
+            if (session_offsets_[s] > session_offsets_[s + 1])
+                throw std::invalid_argument{
+                    "session_offsets must not decrease"};
+        }
+        for (uint64_t k = 0; k < static_cast<uint64_t>(action_ids.size());
+             ++k)
+        {
+            if (action_ids_[k] >= num_actions)
+                throw std::invalid_argument{"action id out of range"};
+        }
+    }
+
+    uint64_t size() const
+    {
+        return num_users_;
+    }
+
+    uint64_t num_sessions() const
+    {
+        return num_sessions_;
+    }
+
+    user operator[](uint64_t i) const
+    {
+        return {*this, i};
+    }
+
+  private:
+    const uint64_t* user_offsets_;
+    const uint64_t* session_offsets_;
+    const uint64_t* action_ids_;
+    const uint64_t* counts_;
+    uint64_t num_users_;
+    uint64_t num_sessions_;
+};
+
+/**
+ * The sessions of each user that have identical histograms, which the
+ * samplers can re-sample as a group when sessions are collapsed: the
+ * groups of user i are groups group_offsets[i] up to (but not including)
+ * group_offsets[i + 1], and group g holds the sessions (numbered within
+ * their user) members[member_offsets[g]] up to
+ * members[member_offsets[g + 1]].
+ */
+struct session_groups
+{
+    session_groups() = default;
+
+    template <class TrainingData>
+    explicit session_groups(const TrainingData& training)
+        : group_offsets(1, 0), member_offsets(1, 0)
+    {
+        using histogram_type = std::vector<std::pair<uint64_t, uint64_t>>;
+        std::map<histogram_type, uint64_t> group_ids;
+        std::vector<std::vector<uint64_t>> groups;
+
+        for (user_id i{0}; i < training.size(); ++i)
+        {
+            group_ids.clear();
+            groups.clear();
+            for (uint64_t j = 0; j < training[i].size(); ++j)
+            {
+                histogram_type histogram;
+                for (const auto& pr : training[i][j])
+                {
+                    if (pr.second > 0)
+                        histogram.emplace_back(
+                            static_cast<uint64_t>(pr.first), pr.second);
+                }
+                std::sort(histogram.begin(), histogram.end());
+
+                auto res = group_ids.emplace(std::move(histogram),
+                                             groups.size());
+                if (res.second)
+                    groups.emplace_back();
+                groups[res.first->second].push_back(j);
+            }
+
+            for (const auto& group : groups)
+            {
+                members.insert(members.end(), group.begin(), group.end());
+                member_offsets.push_back(members.size());
+            }
+            group_offsets.push_back(member_offsets.size() - 1);
+        }
+    }
+
+    std::vector<uint64_t> group_offsets;
+    std::vector<uint64_t> member_offsets;
+    std::vector<uint64_t> members;
+};
+
+/**
+ * Decides when a sampler has converged from its log joint likelihood after
+ * each iteration. Once at least burn_in iterations have run, sampling
+ * stops as soon as the mean log joint likelihood over the last `window`
+ * iterations differs from the mean over the `window` iterations before
+ * them by no more than `tolerance` times the magnitude of the latter. A
+ * window of 0 disables the rule, so that sampling always runs for the full
+ * number of iterations.
+ */
+struct stopping_rule
+{
+    uint64_t burn_in = 0;
+    uint64_t window = 0;
+    double tolerance = 0;
+
+    /**
+     * @param history The log joint likelihood after each iteration so far
+     * @return whether sampling should stop
+     */
+    bool converged(const std::vector<double>& history) const
+    {
+        if (window == 0 || history.size() < std::max(burn_in, 2 * window))
+            return false;
+        auto mid = history.end() - static_cast<std::ptrdiff_t>(window);
+        auto first = mid - static_cast<std::ptrdiff_t>(window);
+        auto mean = std::accumulate(mid, history.end(), 0.0) / window;
+        auto previous_mean = std::accumulate(first, mid, 0.0) / window;
+        return std::abs(mean - previous_mean)
+               <= tolerance * std::abs(previous_mean);
+    }
+};
+
+/**
+ * Caches lgamma(offset + k) for the integers k below a fixed size, for
+ * computing the log of rising factorials of counts that all share the same
+ * fractional pseudo-count offset. Other arguments fall back to
+ * std::lgamma.
+ */
+class lgamma_table
+{
+  public:
+    lgamma_table(double offset, uint64_t size) : offset_{offset}
+    {
+        values_.reserve(size);
+        for (uint64_t k = 0; k < size; ++k)
+            values_.push_back(std::lgamma(offset + k));
+    }
+
+    double operator()(double x) const
+    {
+        auto k = x - offset_ + 0.5;
+        if (k >= 0 && k < values_.size())
+        {
+            auto idx = static_cast<uint64_t>(k);
+            if (std::abs(x - offset_ - idx) < 1e-6)
+                return values_[idx];
+        }
+        return std::lgamma(x);
+    }
+
+    /**
+     * @return log(x) + log(x + 1) + ... + log(x + count - 1)
+     */
+    double log_rising_factorial(double x, uint64_t count) const
+    {
+        return (*this)(x + count) - (*this)(x);
+    }
+
+    /**
+     * @return log_rising_factorial(offset + k, count), for an integer k
+     */
+    double offset_log_rising_factorial(uint64_t k, uint64_t count) const
+    {
+        if (k + count < values_.size())
+            return values_[k + count] - values_[k];
+        return std::lgamma(offset_ + k + count) - std::lgamma(offset_ + k);
+    }
+
+  private:
+    double offset_;
+    std::vector<double> values_;
+};
+
+/**
+ * The sampling weights of the topics for the sessions of one group of
+ * identical sessions. Moving a session from one topic to another only
+ * changes the log weights of those two topics, so the weights are kept as
+ * exp(log weight - reference) and only those two are recomputed for each
+ * session, rather than taking a log and an exp for every topic. The
+ * reference is reset to the largest log weight whenever a weight moves
+ * far enough from it to risk overflow or underflow.
+ */
+class topic_weights
+{
+  public:
+    explicit topic_weights(uint64_t num_topics)
+        : log_weights_(num_topics), weights_(num_topics)
+    {
+        // nothing
+    }
+
+    /**
+     * Sets the log weight of every topic z to log_weight(z).
+     */
+    template <class LogWeight>
+    void reset(LogWeight&& log_weight)
+    {
+        for (uint64_t z = 0; z < log_weights_.size(); ++z)
+            log_weights_[z] = log_weight(z);
+        rebase();
+    }
+
+    void update(uint64_t z, float log_weight)
+    {
+        log_weights_[z] = log_weight;
+        if (log_weight > reference_ + max_offset)
+            rebase();
+        else
+            weights_[z] = std::exp(log_weight - reference_);
+    }
+
+    /**
+     * Draws a topic in proportion to the weights by inverting their CDF.
+     */
+    template <class RandomNumberEngine>
+    uint64_t sample(RandomNumberEngine&& rng)
+    {
+        auto sum = std::accumulate(weights_.begin(), weights_.end(), 0.0);
+        if (sum < min_sum)
+        {
+            rebase();
+            sum = std::accumulate(weights_.begin(), weights_.end(), 0.0);
+        }
+
+        std::uniform_real_distribution<double> dist{0, 1};
+        auto rnd = dist(rng) * sum;
+        uint64_t z = 0;
+        while (z + 1 < weights_.size() && rnd >= weights_[z])
+        {
+            rnd -= weights_[z];
+            ++z;
+        }
+        return z;
+    }
+
+  private:
+    void rebase()
+    {
+        reference_
+            = *std::max_element(log_weights_.begin(), log_weights_.end());
+        for (uint64_t z = 0; z < log_weights_.size(); ++z)
+            weights_[z] = std::exp(log_weights_[z] - reference_);
+    }
+
+    /// how far above the reference a log weight may go before rebasing
+    static constexpr float max_offset = 30;
+
+    /// the smallest sum of the weights that is used without rebasing
+    static constexpr double min_sum = 1e-13;
+
+    std::vector<float> log_weights_;
+    std::vector<double> weights_;
+    float reference_ = 0;
+};
+
 class dm_mixture_model
 {
   public:
@@ -84,22 +577,48 @@ class dm_mixture_model
     // training_data[i] == one user in the collection
     using training_data_type = std::vector<sequences_type>;
 
+    /**
+     * How the likelihood of a session under a topic is computed: product
+     * adds up one log term per action in the session, while lgamma takes
+     * each run of the same action at once as a difference of log-gamma
+     * functions, so that its cost depends only on the number of distinct
+     * actions in the session.
+     */
+    enum class likelihood_kernel
+    {
+        product,
+        lgamma
+    };
+
+    /**
+     * Which model run_chains fits: sparse is a dm_mixture_model, which
+     * keeps its counts in meta's multinomials, and dense is a
+     * dense_mixture_model.
+     */
+    enum class backend
+    {
+        sparse,
+        dense
+    };
+
     struct options_type
     {
         uint8_t num_topics = 5;
         uint64_t num_actions;
         double alpha = 0.1;
         double beta = 0.1;
+        // sample the sessions of a user that have identical histograms
+        // together, as one group
+        bool collapse_sessions = false;
+        likelihood_kernel kernel = likelihood_kernel::product;
+        backend model_backend = backend::sparse;
     };
 
-    template <class RandomNumberEngine>
-    dm_mixture_model(const training_data_type& training, options_type opts,
+    template <class TrainingData, class RandomNumberEngine>
+    dm_mixture_model(const TrainingData& training, options_type opts,
                      RandomNumberEngine&& rng)
-        : topic_assignments_(
-              std::accumulate(std::begin(training), std::end(training), 0ul,
-                              [](uint64_t accum, const sequences_type& seqs) {
-                                  return accum + seqs.size();
-                              })),
+        : num_actions_{opts.num_actions},
+          topic_assignments_(num_sessions(training)),
           // initialize all topics with the same prior pseudo-counts
           topics_(opts.num_topics,
                   stats::multinomial<action_type>{stats::dirichlet<action_type>(
@@ -107,15 +626,34 @@ class dm_mixture_model
           topic_proportions_(
               training.size(),
               stats::multinomial<topic_id>{
-                  stats::dirichlet<topic_id>(opts.alpha, opts.num_topics)})
+                  stats::dirichlet<topic_id>(opts.alpha, opts.num_topics)}),
+          collapse_sessions_{opts.collapse_sessions},
+          kernel_{opts.kernel},
+          lgamma_counts_{opts.beta,
+                         kernel_ == likelihood_kernel::lgamma
+                             ? lgamma_table_size
+                             : 0},
+          lgamma_totals_{opts.beta * opts.num_actions,
+                         kernel_ == likelihood_kernel::lgamma
+                             ? lgamma_table_size
+                             : 0}
     {
+        if (collapse_sessions_)
+            groups_ = session_groups{training};
         initialize(training, std::forward<RandomNumberEngine>(rng));
     }
 
-    template <class RandomNumberEngine, class ProgressReporter>
-    void run(const training_data_type& training, uint64_t num_iters,
-             RandomNumberEngine&& rng, ProgressReporter&& progress)
+    /**
+     * Runs up to num_iters iterations, stopping early once the stopping
+     * rule finds that the log joint likelihood has converged.
+     */
+    template <class TrainingData, class RandomNumberEngine,
+              class ProgressReporter>
+    void run(const TrainingData& training, uint64_t num_iters,
+             RandomNumberEngine&& rng, ProgressReporter&& progress,
+             const stopping_rule& stop = {})
     {
+        std::vector<double> history;
         progress(0, num_iters, topic_assignments_.size(),
                  topic_assignments_.size(), log_joint_likelihood());
         for (uint64_t iter = 1; iter <= num_iters; ++iter)
@@ -124,16 +662,29 @@ class dm_mixture_model
                               [&](uint64_t idx, uint64_t total) {
                                   progress(iter, num_iters, idx, total);
                               });
+            ++num_iterations_;
+            history.push_back(log_joint_likelihood());
             progress(iter, num_iters, topic_assignments_.size(),
-                     topic_assignments_.size(), log_joint_likelihood());
+                     topic_assignments_.size(), history.back());
+            if (stop.converged(history))
+                break;
         }
     }
 
-    template <class RandomNumberEngine, class ProgressReporter>
-    void perform_iteration(const training_data_type& training,
+    template <class TrainingData, class RandomNumberEngine,
+              class ProgressReporter>
+    void perform_iteration(const TrainingData& training,
                            RandomNumberEngine&& rng,
                            ProgressReporter&& progress)
     {
+        if (collapse_sessions_)
+        {
+            perform_collapsed_iteration(
+                training, std::forward<RandomNumberEngine>(rng),
+                std::forward<ProgressReporter>(progress));
+            return;
+        }
+
         const auto total = topic_assignments_.size();
         uint64_t x = 0;
         for (user_id i{0}; i < training.size(); ++i)
@@ -164,6 +715,99 @@ class dm_mixture_model
         }
     }
 
+    /**
+     * Performs an iteration over the groups of identical sessions. The
+     * sessions of a group are still re-sampled one at a time, but since
+     * they are identical, moving one of them only changes its likelihood
+     * and its user's proportion for the topic it left and the topic it
+     * joined. The sampling weight of each topic is therefore computed once
+     * per group, when its first session is re-sampled, and then only
+     * updated for those two topics, rather than being recomputed for every
+     * topic for every session. A group of one session costs the same as
+     * re-sampling it in perform_iteration.
+     */
+    template <class TrainingData, class RandomNumberEngine,
+              class ProgressReporter>
+    void perform_collapsed_iteration(const TrainingData& training,
+                                     RandomNumberEngine&& rng,
+                                     ProgressReporter&& progress)
+    {
+        const auto total = topic_assignments_.size();
+        const auto num_topics = topics_.size();
+        std::vector<float> log_likelihoods(num_topics);
+        topic_weights weights{num_topics};
+
+        uint64_t x = 0;
+        uint64_t done = 0;
+        for (user_id i{0}; i < training.size(); ++i)
+        {
+            for (auto g = groups_.group_offsets[i];
+                 g < groups_.group_offsets[i + 1]; ++g)
+            {
+                auto first
+                    = groups_.members.begin() + groups_.member_offsets[g];
+                auto last
+                    = groups_.members.begin() + groups_.member_offsets[g + 1];
+                const auto& session = training[i][*first];
+
+                // the user's total count is the same whenever a session is
+                // sampled, so the proportions of the topics left alone
+                // since the last session are unchanged
+                auto log_weight = [&](topic_id z) {
+                    return fastapprox::fastlog(static_cast<float>(
+                               topic_proportions_[i].probability(z)))
+                           + log_likelihoods[z];
+                };
+                topic_id last_z{0};
+                for (auto it = first; it != last; ++it)
+                {
+                    // remove counts
+                    auto old_z = topic_assignments_[x + *it];
+                    topic_proportions_[i].decrement(old_z, 1.0);
+                    for (const auto& pr : session)
+                    {
+                        topics_[old_z].decrement(pr.first, pr.second);
+                    }
+
+                    // sample new topic
+                    if (it == first)
+                    {
+                        for (topic_id z{0}; z < num_topics; ++z)
+                        {
+                            log_likelihoods[z]
+                                = log_likelihood(z, session, 0.0f);
+                        }
+                        weights.reset([&](uint64_t z) {
+                            return log_weight(topic_id{z});
+                        });
+                    }
+                    else
+                    {
+                        log_likelihoods[old_z]
+                            = log_likelihood(old_z, session, 0.0f);
+                        weights.update(last_z, log_weight(last_z));
+                        weights.update(old_z, log_weight(old_z));
+                    }
+                    topic_id z{weights.sample(rng)};
+                    topic_assignments_[x + *it] = z;
+
+                    // update counts
+                    topic_proportions_[i].increment(z, 1.0);
+                    for (const auto& pr : session)
+                    {
+                        topics_[z].increment(pr.first, pr.second);
+                    }
+                    if (it + 1 != last)
+                        log_likelihoods[z] = log_likelihood(z, session, 0.0f);
+                    last_z = z;
+                }
+                done += static_cast<uint64_t>(last - first);
+                progress(done, total);
+            }
+            x += training[i].size();
+        }
+    }
+
     double log_joint_likelihood() const
     {
         // log p(w, z) = log p(w | z)p(z) = log p(w|z) + log p(z)
@@ -199,6 +843,30 @@ class dm_mixture_model
         io::packed::write(topic_proportions_file, topic_proportions_);
     }
 
+    uint64_t num_actions() const
+    {
+        return num_actions_;
+    }
+
+    uint64_t num_users() const
+    {
+        return topic_proportions_.size();
+    }
+
+    uint64_t num_sessions() const
+    {
+        return topic_assignments_.size();
+    }
+
+    /**
+     * @return the number of sampling iterations run so far, not counting
+     * the initialization
+     */
+    uint64_t num_iterations() const
+    {
+        return num_iterations_;
+    }
+
     topic_id topic_assignment(session_id id) const
     {
         return topic_assignments_.at(id);
@@ -215,9 +883,21 @@ class dm_mixture_model
     }
 
   private:
-    template <class RandomNumberEngine>
-    void initialize(const training_data_type& training,
-                    RandomNumberEngine&& rng)
+    static uint64_t num_sessions(const training_data_type& training)
+    {
+        return std::accumulate(std::begin(training), std::end(training), 0ul,
+                               [](uint64_t accum, const sequences_type& seqs) {
+                                   return accum + seqs.size();
+                               });
+    }
+
+    static uint64_t num_sessions(const csr_training_data& training)
+    {
+        return training.num_sessions();
+    }
+
+    template <class TrainingData, class RandomNumberEngine>
+    void initialize(const TrainingData& training, RandomNumberEngine&& rng)
     {
         printing::progress progress{" > Initialization: ",
                                     topic_assignments_.size()};
@@ -241,8 +921,8 @@ class dm_mixture_model
         }
     }
 
-    template <class RandomNumberEngine>
-    topic_id sample_topic(user_id i, const session_type& session,
+    template <class Session, class RandomNumberEngine>
+    topic_id sample_topic(user_id i, const Session& session,
                           RandomNumberEngine&& rng)
     {
         //
@@ -262,23 +942,10 @@ class dm_mixture_model
         {
             // compute the sampling probability (up to proportionality) in
             // log-space to avoid underflow
-            auto denom = static_cast<float>(topics_[z].counts());
-            auto log_prob = fastapprox::fastlog(
-                static_cast<float>(topic_proportions_[i].probability(z)));
-            uint64_t j = 0;
-            for (const auto& pr : session)
-            {
-                const auto& word = pr.first;
-                const auto& count = pr.second;
-
-                for (uint64_t i = 0; i < count; ++i)
-                {
-                    log_prob += fastapprox::fastlog(
-                        static_cast<float>(topics_[z].counts(word)) + i);
-                    log_prob -= fastapprox::fastlog(denom + j);
-                    ++j;
-                }
-            }
+            auto log_prob = log_likelihood(
+                z, session,
+                fastapprox::fastlog(
+                    static_cast<float>(topic_proportions_[i].probability(z))));
 
             // apply the Gumbel-max trick to update the sample
             auto rnd = dist(rng);
@@ -294,6 +961,47 @@ class dm_mixture_model
         return result;
     }
 
+    /**
+     * Adds the log probability (up to proportionality) of the session's
+     * actions being drawn from topic z to log_prob.
+     */
+    template <class Session>
+    float log_likelihood(topic_id z, const Session& session,
+                         float log_prob) const
+    {
+        if (kernel_ == likelihood_kernel::lgamma)
+        {
+            auto log_likelihood = 0.0;
+            uint64_t length = 0;
+            for (const auto& pr : session)
+            {
+                log_likelihood += lgamma_counts_.log_rising_factorial(
+                    topics_[z].counts(pr.first), pr.second);
+                length += pr.second;
+            }
+            log_likelihood -= lgamma_totals_.log_rising_factorial(
+                topics_[z].counts(), length);
+            return log_prob + static_cast<float>(log_likelihood);
+        }
+
+        auto denom = static_cast<float>(topics_[z].counts());
+        uint64_t j = 0;
+        for (const auto& pr : session)
+        {
+            const auto& word = pr.first;
+            const auto& count = pr.second;
+
+            for (uint64_t i = 0; i < count; ++i)
+            {
+                log_prob += fastapprox::fastlog(
+                    static_cast<float>(topics_[z].counts(word)) + i);
+                log_prob -= fastapprox::fastlog(denom + j);
+                ++j;
+            }
+        }
+        return log_prob;
+    }
+
     template <class T>
     double dm_log_likelihood(const stats::multinomial<T>& dist) const
     {
@@ -308,9 +1016,15 @@ class dm_mixture_model
         return log_likelihood;
     }
 
+    /// the number of distinct actions
+    uint64_t num_actions_;
+
     /// the topic assignment for each session
     std::vector<topic_id> topic_assignments_;
 
+    /// the number of sampling iterations run so far
+    uint64_t num_iterations_ = 0;
+
     /**
      * The action distributions for each role. Doubles as storage for the
      * count information for each role.
@@ -322,8 +1036,930 @@ class dm_mixture_model
      * count information for each network.
      */
     std::vector<stats::multinomial<topic_id>> topic_proportions_;
+
+    /// whether sessions are sampled in groups of identical sessions
+    bool collapse_sessions_;
+
+    /// how the likelihood of a session under a topic is computed
+    likelihood_kernel kernel_;
+
+    /// the number of lgamma values cached for the lgamma kernel
+    static constexpr uint64_t lgamma_table_size = 1 << 16;
+
+    /// lgamma of the counts of an action in a topic, with its pseudo-count
+    lgamma_table lgamma_counts_;
+
+    /// lgamma of the total counts of a topic, with its pseudo-counts
+    lgamma_table lgamma_totals_;
+
+    /// the groups of identical sessions, when sessions are collapsed
+    session_groups groups_;
 };
 
+/**
+ * A dm_mixture_model that keeps its counts in dense arrays rather than in
+ * meta's multinomials. There are only a few dozen action types and a
+ * handful of topics, so the counts of every action in every topic fit in
+ * a small K x A matrix. It is stored action-major, so that the counts of
+ * one action in all of the topics are contiguous and a session can be
+ * scored against every topic at once in loops over the topics that the
+ * compiler can vectorize. Topic assignments are kept in a byte each.
+ *
+ * It samples from the same distribution as dm_mixture_model with the same
+ * options, but it draws each topic by inverting the CDF of the normalized
+ * sampling probabilities rather than with the Gumbel-max trick, so the
+ * two do not produce the same samples.
+ */
+class dense_mixture_model
+{
+  public:
+    using options_type = dm_mixture_model::options_type;
+    using likelihood_kernel = dm_mixture_model::likelihood_kernel;
+    using count_type = uint32_t;
+
+    template <class TrainingData, class RandomNumberEngine>
+    dense_mixture_model(const TrainingData& training, options_type opts,
+                        RandomNumberEngine&& rng)
+        : num_topics_{opts.num_topics},
+          num_actions_{opts.num_actions},
+          alpha_{opts.alpha},
+          beta_{opts.beta},
+          collapse_sessions_{opts.collapse_sessions},
+          kernel_{opts.kernel},
+          topic_assignments_(num_sessions(training)),
+          action_counts_(num_actions_ * num_topics_),
+          topic_counts_(num_topics_),
+          user_counts_(training.size() * num_topics_),
+          lgamma_counts_{opts.beta,
+                         kernel_ == likelihood_kernel::lgamma
+                             ? lgamma_table_size
+                             : 0},
+          lgamma_totals_{opts.beta * opts.num_actions,
+                         kernel_ == likelihood_kernel::lgamma
+                             ? lgamma_table_size
+                             : 0},
+          log_probs_(num_topics_),
+          log_likelihoods_(num_topics_)
+    {
+        if (num_topics_ == 0)
+            throw std::invalid_argument{"num_topics must be at least 1"};
+        if (collapse_sessions_)
+            groups_ = session_groups{training};
+        initialize(training, std::forward<RandomNumberEngine>(rng));
+    }
+
+    /**
+     * Runs up to num_iters iterations, stopping early once the stopping
+     * rule finds that the log joint likelihood has converged.
+     */
+    template <class TrainingData, class RandomNumberEngine,
+              class ProgressReporter>
+    void run(const TrainingData& training, uint64_t num_iters,
+             RandomNumberEngine&& rng, ProgressReporter&& progress,
+             const stopping_rule& stop = {})
+    {
+        std::vector<double> history;
+        progress(0, num_iters, topic_assignments_.size(),
+                 topic_assignments_.size(), log_joint_likelihood());
+        for (uint64_t iter = 1; iter <= num_iters; ++iter)
+        {
+            perform_iteration(training, std::forward<RandomNumberEngine>(rng),
+                              [&](uint64_t idx, uint64_t total) {
+                                  progress(iter, num_iters, idx, total);
+                              });
+            ++num_iterations_;
+            history.push_back(log_joint_likelihood());
+            progress(iter, num_iters, topic_assignments_.size(),
+                     topic_assignments_.size(), history.back());
+            if (stop.converged(history))
+                break;
+        }
+    }
+
+    template <class TrainingData, class RandomNumberEngine,
+              class ProgressReporter>
+    void perform_iteration(const TrainingData& training,
+                           RandomNumberEngine&& rng,
+                           ProgressReporter&& progress)
+    {
+        if (collapse_sessions_)
+        {
+            perform_collapsed_iteration(
+                training, std::forward<RandomNumberEngine>(rng),
+                std::forward<ProgressReporter>(progress));
+            return;
+        }
+
+        const auto total = topic_assignments_.size();
+        uint64_t x = 0;
+        for (uint64_t i = 0; i < training.size(); ++i)
+        {
+            for (uint64_t j = 0; j < training[i].size(); ++j)
+            {
+                const auto& session = training[i][j];
+                remove(i, topic_assignments_[x], session);
+                session_log_likelihoods(session, log_likelihoods_.data());
+                auto z = sample_topic(i, rng);
+                topic_assignments_[x] = z;
+                add(i, z, session);
+                progress(++x, total);
+            }
+        }
+    }
+
+    /**
+     * Performs an iteration over the groups of identical sessions, in the
+     * same way as dm_mixture_model::perform_collapsed_iteration.
+     */
+    template <class TrainingData, class RandomNumberEngine,
+              class ProgressReporter>
+    void perform_collapsed_iteration(const TrainingData& training,
+                                     RandomNumberEngine&& rng,
+                                     ProgressReporter&& progress)
+    {
+        const auto total = topic_assignments_.size();
+        const auto alpha = static_cast<float>(alpha_);
+        topic_weights weights{num_topics_};
+        uint64_t x = 0;
+        uint64_t done = 0;
+        for (uint64_t i = 0; i < training.size(); ++i)
+        {
+            for (auto g = groups_.group_offsets[i];
+                 g < groups_.group_offsets[i + 1]; ++g)
+            {
+                auto first
+                    = groups_.members.begin() + groups_.member_offsets[g];
+                auto last
+                    = groups_.members.begin() + groups_.member_offsets[g + 1];
+                const auto& session = training[i][*first];
+
+                const auto* counts = &user_counts_[i * num_topics_];
+                auto log_weight = [&](uint64_t z) {
+                    return fastapprox::fastlog(static_cast<float>(counts[z])
+                                               + alpha)
+                           + log_likelihoods_[z];
+                };
+                uint8_t last_z = 0;
+                for (auto it = first; it != last; ++it)
+                {
+                    auto old_z = topic_assignments_[x + *it];
+                    remove(i, old_z, session);
+                    if (it == first)
+                    {
+                        session_log_likelihoods(session,
+                                                log_likelihoods_.data());
+                        weights.reset(log_weight);
+                    }
+                    else
+                    {
+                        log_likelihoods_[old_z]
+                            = topic_log_likelihood(old_z, session);
+                        weights.update(last_z, log_weight(last_z));
+                        weights.update(old_z, log_weight(old_z));
+                    }
+                    auto z = static_cast<uint8_t>(weights.sample(rng));
+                    topic_assignments_[x + *it] = z;
+                    add(i, z, session);
+                    if (it + 1 != last)
+                        log_likelihoods_[z] = topic_log_likelihood(z, session);
+                    last_z = z;
+                }
+                done += static_cast<uint64_t>(last - first);
+                progress(done, total);
+            }
+            x += training[i].size();
+        }
+    }
+
+    double log_joint_likelihood() const
+    {
+        // the same Dirichlet-multinomial likelihoods as
+        // dm_mixture_model::log_joint_likelihood, with the actions and
+        // topics that were never seen contributing nothing
+        auto log_likelihood = 0.0;
+        const auto total_beta = beta_ * num_actions_;
+        for (uint64_t z = 0; z < num_topics_; ++z)
+        {
+            log_likelihood += std::lgamma(total_beta);
+            log_likelihood -= std::lgamma(topic_counts_[z] + total_beta);
+        }
+        for (uint64_t w = 0; w < num_actions_; ++w)
+        {
+            for (uint64_t z = 0; z < num_topics_; ++z)
+            {
+                auto count = action_counts_[w * num_topics_ + z];
+                if (count > 0)
+                {
+                    log_likelihood += std::lgamma(count + beta_);
+                    log_likelihood -= std::lgamma(beta_);
+                }
+            }
+        }
+
+        const auto total_alpha = alpha_ * num_topics_;
+        const auto num_users = user_counts_.size() / num_topics_;
+        for (uint64_t i = 0; i < num_users; ++i)
+        {
+            count_type sessions = 0;
+            for (uint64_t z = 0; z < num_topics_; ++z)
+            {
+                auto count = user_counts_[i * num_topics_ + z];
+                sessions += count;
+                if (count > 0)
+                {
+                    log_likelihood += std::lgamma(count + alpha_);
+                    log_likelihood -= std::lgamma(alpha_);
+                }
+            }
+            log_likelihood += std::lgamma(total_alpha);
+            log_likelihood -= std::lgamma(sessions + total_alpha);
+        }
+
+        return log_likelihood;
+    }
+
+    uint64_t num_actions() const
+    {
+        return num_actions_;
+    }
+
+    uint64_t num_users() const
+    {
+        return user_counts_.size() / num_topics_;
+    }
+
+    uint64_t num_sessions() const
+    {
+        return topic_assignments_.size();
+    }
+
+    /**
+     * @return the number of sampling iterations run so far, not counting
+     * the initialization
+     */
+    uint64_t num_iterations() const
+    {
+        return num_iterations_;
+    }
+
+    topic_id topic_assignment(session_id id) const
+    {
+        return topic_id{topic_assignments_.at(id)};
+    }
+
+    double action_probability(topic_id id, action_type aid) const
+    {
+        if (id >= num_topics_ || aid >= num_actions_)
+            throw std::out_of_range{"no such topic or action"};
+        return (action_counts_[aid * num_topics_ + id] + beta_)
+               / (topic_counts_[id] + beta_ * num_actions_);
+    }
+
+    double role_probability(user_id uid, topic_id tid) const
+    {
+        if (uid >= user_counts_.size() / num_topics_ || tid >= num_topics_)
+            throw std::out_of_range{"no such user or topic"};
+        count_type sessions = 0;
+        for (uint64_t z = 0; z < num_topics_; ++z)
+            sessions += user_counts_[uid * num_topics_ + z];
+        return (user_counts_[uid * num_topics_ + tid] + alpha_)
+               / (sessions + alpha_ * num_topics_);
+    }
+
+  private:
+    template <class TrainingData>
+    static uint64_t num_sessions(const TrainingData& training)
+    {
+        uint64_t total = 0;
+        for (uint64_t i = 0; i < training.size(); ++i)
+            total += training[i].size();
+        return total;
+    }
+
+    template <class TrainingData, class RandomNumberEngine>
+    void initialize(const TrainingData& training, RandomNumberEngine&& rng)
+    {
+        printing::progress progress{" > Initialization: ",
+                                    topic_assignments_.size()};
+
+        // proceed like a normal sampling pass, but without removing any counts
+        uint64_t x = 0;
+        for (uint64_t i = 0; i < training.size(); ++i)
+        {
+            for (uint64_t j = 0; j < training[i].size(); ++j)
+            {
+                const auto& session = training[i][j];
+                session_log_likelihoods(session, log_likelihoods_.data());
+                auto z = sample_topic(i, rng);
+                topic_assignments_[x] = z;
+                add(i, z, session);
+                progress(++x);
+            }
+        }
+    }
+
+    template <class Session>
+    void add(uint64_t i, uint8_t z, const Session& session)
+    {
+        ++user_counts_[i * num_topics_ + z];
+        for (const auto& pr : session)
+        {
+            action_counts_[pr.first * num_topics_ + z] += pr.second;
+            topic_counts_[z] += pr.second;
+        }
+    }
+
+    template <class Session>
+    void remove(uint64_t i, uint8_t z, const Session& session)
+    {
+        --user_counts_[i * num_topics_ + z];
+        for (const auto& pr : session)
+        {
+            action_counts_[pr.first * num_topics_ + z] -= pr.second;
+            topic_counts_[z] -= pr.second;
+        }
+    }
+
+    /**
+     * Computes the log probability (up to proportionality) of the
+     * session's actions being drawn from each topic, for all of the
+     * topics at once.
+     */
+    template <class Session>
+    void session_log_likelihoods(const Session& session, float* out) const
+    {
+        const auto num_topics = num_topics_;
+        std::fill(out, out + num_topics, 0.0f);
+
+        uint64_t length = 0;
+        if (kernel_ == likelihood_kernel::lgamma)
+        {
+            for (const auto& pr : session)
+            {
+                const auto* counts = &action_counts_[pr.first * num_topics];
+                for (uint64_t z = 0; z < num_topics; ++z)
+                {
+                    out[z] += static_cast<float>(
+                        lgamma_counts_.offset_log_rising_factorial(counts[z],
+                                                                   pr.second));
+                }
+                length += pr.second;
+            }
+            for (uint64_t z = 0; z < num_topics; ++z)
+            {
+                out[z] -= static_cast<float>(
+                    lgamma_totals_.offset_log_rising_factorial(
+                        topic_counts_[z], length));
+            }
+            return;
+        }
+
+        const auto beta = static_cast<float>(beta_);
+        for (const auto& pr : session)
+        {
+            const auto* counts = &action_counts_[pr.first * num_topics];
+            for (uint64_t c = 0; c < pr.second; ++c)
+            {
+                const auto offset = beta + c;
+                for (uint64_t z = 0; z < num_topics; ++z)
+                {
+                    out[z] += fastapprox::fastlog(
+                        static_cast<float>(counts[z]) + offset);
+                }
+            }
+            length += pr.second;
+        }
+
+        const auto total_beta = static_cast<float>(beta_ * num_actions_);
+        const auto* totals = topic_counts_.data();
+        for (uint64_t j = 0; j < length; ++j)
+        {
+            const auto offset = total_beta + j;
+            for (uint64_t z = 0; z < num_topics; ++z)
+            {
+                out[z] -= fastapprox::fastlog(static_cast<float>(totals[z])
+                                              + offset);
+            }
+        }
+    }
+
+    /**
+     * Computes the log probability (up to proportionality) of the
+     * session's actions being drawn from topic z alone.
+     */
+    template <class Session>
+    float topic_log_likelihood(uint8_t z, const Session& session) const
+    {
+        auto log_likelihood = 0.0;
+        uint64_t length = 0;
+        for (const auto& pr : session)
+        {
+            auto count = action_counts_[pr.first * num_topics_ + z];
+            if (kernel_ == likelihood_kernel::lgamma)
+            {
+                log_likelihood += lgamma_counts_.offset_log_rising_factorial(
+                    count, pr.second);
+            }
+            else
+            {
+                for (uint64_t c = 0; c < pr.second; ++c)
+                    log_likelihood += fastapprox::fastlog(
+                        static_cast<float>(count) + static_cast<float>(beta_)
+                        + c);
+            }
+            length += pr.second;
+        }
+
+        if (kernel_ == likelihood_kernel::lgamma)
+        {
+            log_likelihood -= lgamma_totals_.offset_log_rising_factorial(
+                topic_counts_[z], length);
+        }
+        else
+        {
+            const auto total_beta = static_cast<float>(beta_ * num_actions_);
+            for (uint64_t j = 0; j < length; ++j)
+                log_likelihood -= fastapprox::fastlog(
+                    static_cast<float>(topic_counts_[z]) + total_beta + j);
+        }
+        return static_cast<float>(log_likelihood);
+    }
+
+    /**
+     * Draws a topic for a session of user i from the session likelihoods
+     * in log_likelihoods_, by inverting the CDF of the normalized
+     * sampling probabilities.
+     */
+    template <class RandomNumberEngine>
+    uint8_t sample_topic(uint64_t i, RandomNumberEngine&& rng)
+    {
+        const auto num_topics = num_topics_;
+        const auto alpha = static_cast<float>(alpha_);
+        const auto* counts = &user_counts_[i * num_topics];
+        auto* log_probs = log_probs_.data();
+
+        // the user's total count is the same for every topic, so it is
+        // left out of the topic proportions
+        auto max_value = std::numeric_limits<float>::lowest();
+        for (uint64_t z = 0; z < num_topics; ++z)
+        {
+            log_probs[z] = fastapprox::fastlog(static_cast<float>(counts[z])
+                                               + alpha)
+                           + log_likelihoods_[z];
+            max_value = std::max(max_value, log_probs[z]);
+        }
+        for (uint64_t z = 0; z < num_topics; ++z)
+            log_probs[z] = fastapprox::fastexp(log_probs[z] - max_value);
+
+        auto sum = 0.0;
+        for (uint64_t z = 0; z < num_topics; ++z)
+            sum += log_probs[z];
+
+        std::uniform_real_distribution<double> dist{0, 1};
+        auto rnd = dist(rng) * sum;
+        uint8_t z = 0;
+        while (z + 1u < num_topics && rnd >= log_probs[z])
+        {
+            rnd -= log_probs[z];
+            ++z;
+        }
+        return z;
+    }
+
+    /// the number of topics
+    uint64_t num_topics_;
+
+    /// the number of distinct actions
+    uint64_t num_actions_;
+
+    /// the prior pseudo-count of each topic in each user's proportions
+    double alpha_;
+
+    /// the prior pseudo-count of each action in each topic
+    double beta_;
+
+    /// whether sessions are sampled in groups of identical sessions
+    bool collapse_sessions_;
+
+    /// how the likelihood of a session under a topic is computed
+    likelihood_kernel kernel_;
+
+    /// the topic assignment for each session
+    std::vector<uint8_t> topic_assignments_;
+
+    /// the number of sampling iterations run so far
+    uint64_t num_iterations_ = 0;
+
+    /// the count of each action in each topic, action-major
+    std::vector<count_type> action_counts_;
+
+    /// the total count of all actions in each topic
+    std::vector<count_type> topic_counts_;
+
+    /// the number of sessions of each user assigned to each topic
+    std::vector<count_type> user_counts_;
+
+    /// the number of lgamma values cached for the lgamma kernel
+    static constexpr uint64_t lgamma_table_size = 1 << 16;
+
+    /// lgamma of the counts of an action in a topic, with its pseudo-count
+    lgamma_table lgamma_counts_;
+
+    /// lgamma of the total counts of a topic, with its pseudo-counts
+    lgamma_table lgamma_totals_;
+
+    /// the groups of identical sessions, when sessions are collapsed
+    session_groups groups_;
+
+    /// scratch space for sampling, one entry per topic
+    std::vector<float> log_probs_;
+    std::vector<float> log_likelihoods_;
+};
+
+/**
+ * Thrown from within a chain's progress reporter to stop the chain early
+ * when another chain has failed or the run has been abandoned.
+ */
+struct chain_cancelled : public std::exception
+{
+    const char* what() const noexcept override
+    {
+        return "chain cancelled";
+    }
+};
+
+/**
+ * Fits num_chains models of type Model (a dm_mixture_model or a
+ * dense_mixture_model) to the same training data, each on its own
+ * thread. Chain c samples from a copy of rng that has been jumped ahead c
+ * times, so the chains draw from non-overlapping streams and a single
+ * chain samples exactly as Model::run would; rng itself is left jumped
+ * ahead num_chains times.
+ *
+ * Each chain stops on its own once the stopping rule finds that it has
+ * converged, and Model::num_iterations tells how far it got.
+ *
+ * The progress reporter is only ever called from the calling thread:
+ * once every chain has finished an iteration, it is called with the best
+ * log joint likelihood of the chains at that iteration, where a chain that
+ * has already stopped counts with its final log joint likelihood.
+ */
+template <class Model, class TrainingData, class ProgressReporter>
+std::vector<std::unique_ptr<Model>>
+run_chains(const TrainingData& training, typename Model::options_type opts,
+           uint64_t num_chains, uint64_t num_iters, xoroshiro128& rng,
+           ProgressReporter&& progress, const stopping_rule& stop = {})
+{
+    std::vector<xoroshiro128> rngs;
+    std::vector<std::unique_ptr<Model>> models;
+    for (uint64_t c = 0; c < num_chains; ++c)
+    {
+        rngs.push_back(rng);
+        rng.jump();
+        models.emplace_back(new Model(training, opts, rngs[c]));
+    }
+
+    // the log joint likelihood of each chain after every iteration so far
+    std::vector<std::vector<double>> log_likelihoods(num_chains);
+    std::vector<std::exception_ptr> errors(num_chains);
+    std::vector<bool> stopped(num_chains, false);
+    std::atomic<bool> cancelled{false};
+    std::mutex mutex;
+    std::condition_variable changed;
+
+    struct chain_progress
+    {
+        void operator()(uint64_t, uint64_t, uint64_t, uint64_t) const
+        {
+            if (cancelled.load(std::memory_order_relaxed))
+                throw chain_cancelled{};
+        }
+
+        void operator()(uint64_t, uint64_t, uint64_t, uint64_t,
+                        double log_likelihood) const
+        {
+            {
+                std::lock_guard<std::mutex> lock{mutex};
+                history.push_back(log_likelihood);
+            }
+            changed.notify_one();
+            (*this)(0, 0, 0, 0);
+        }
+
+        std::vector<double>& history;
+        const std::atomic<bool>& cancelled;
+        std::mutex& mutex;
+        std::condition_variable& changed;
+    };
+
+    std::vector<std::thread> threads;
+    // the threads must not outlive the state above, even if reporting
+    // progress throws
+    auto join = [&]() {
+        cancelled = true;
+        for (auto& thread : threads)
+            thread.join();
+    };
+    try
+    {
+        for (uint64_t c = 0; c < num_chains; ++c)
+        {
+            threads.emplace_back([&, c]() {
+                try
+                {
+                    chain_progress chain{log_likelihoods[c], cancelled, mutex,
+                                         changed};
+                    models[c]->run(training, num_iters, rngs[c], chain,
+                                   stop);
+                }
+                catch (const chain_cancelled&)
+                {
+                    // nothing
+                }
+                catch (...)
+                {
+                    errors[c] = std::current_exception();
+                    cancelled = true;
+                }
+                {
+                    std::lock_guard<std::mutex> lock{mutex};
+                    stopped[c] = true;
+                }
+                changed.notify_one();
+            });
+        }
+
+        const auto total = models.front()->num_sessions();
+        for (uint64_t iter = 0; iter <= num_iters; ++iter)
+        {
+            auto best_log_likelihood = std::numeric_limits<double>::lowest();
+            {
+                std::unique_lock<std::mutex> lock{mutex};
+                auto finished = [&]() {
+                    for (uint64_t c = 0; c < num_chains; ++c)
+                    {
+                        if (log_likelihoods[c].size() <= iter && !stopped[c])
+                            return false;
+                    }
+                    return true;
+                };
+                changed.wait(lock, [&]() { return cancelled || finished(); });
+                if (cancelled)
+                    break;
+
+                auto reached = false;
+                for (const auto& history : log_likelihoods)
+                {
+                    reached = reached || history.size() > iter;
+                    if (!history.empty())
+                    {
+                        best_log_likelihood = std::max(
+                            best_log_likelihood,
+                            history[std::min<uint64_t>(iter,
+                                                       history.size() - 1)]);
+                    }
+                }
+                // every chain has stopped
+                if (!reached)
+                    break;
+            }
+            progress(iter, num_iters, total, total, best_log_likelihood);
+        }
+    }
+    catch (...)
+    {
+        join();
+        throw;
+    }
+    join();
+
+    for (const auto& error : errors)
+    {
+        if (error)
+            std::rethrow_exception(error);
+    }
+    return models;
+}
+
+/**
+ * Adapts a Python progress callback for a sampling loop that runs with the
+ * GIL released. The end of every iteration is always reported, along with
+ * its log joint likelihood, but progress within an iteration is only
+ * reported once every `every` sessions or once `interval` seconds have
+ * passed since the last report, whichever comes first; either can be
+ * disabled by setting it to 0.
+ */
+class python_progress
+{
+  public:
+    using clock = std::chrono::steady_clock;
+
+    python_progress(py::function& progress, uint64_t every, double interval)
+        : progress_(progress),
+          every_{every},
+          interval_{std::chrono::duration_cast<clock::duration>(
+              std::chrono::duration<double>{interval})},
+          last_report_{clock::now()}
+    {
+        // nothing
+    }
+
+    void operator()(uint64_t iter, uint64_t num_iters, uint64_t idx,
+                    uint64_t total)
+    {
+        if (every_ > 0 && idx - last_idx_ >= every_)
+        {
+            report(iter, num_iters, idx, total);
+        }
+        else if (interval_ > clock::duration::zero())
+        {
+            if (clock::now() - last_report_ >= interval_)
+                report(iter, num_iters, idx, total);
+        }
+    }
+
+    void operator()(uint64_t iter, uint64_t num_iters, uint64_t idx,
+                    uint64_t total, double log_likelihood)
+    {
+        py::gil_scoped_acquire acquire;
+        progress_(iter, num_iters, idx, total, log_likelihood);
+        last_idx_ = 0;
+        last_report_ = clock::now();
+    }
+
+  private:
+    void report(uint64_t iter, uint64_t num_iters, uint64_t idx,
+                uint64_t total)
+    {
+        py::gil_scoped_acquire acquire;
+        progress_(iter, num_iters, idx, total);
+        last_idx_ = idx;
+        last_report_ = clock::now();
+    }
+
+    py::function& progress_;
+    uint64_t every_;
+    clock::duration interval_;
+    clock::time_point last_report_;
+    /// the number of sessions sampled this iteration at the last report
+    uint64_t last_idx_ = 0;
+};
+
+/**
+ * Throws std::invalid_argument if any session in the training data refers
+ * to an action id of num_actions or more, which csr_training_data checks
+ * for itself.
+ */
+inline void check_action_ids(
+    const dm_mixture_model::training_data_type& training,
+    uint64_t num_actions)
+{
+    for (const auto& sequences : training)
+    {
+        for (const auto& session : sequences)
+        {
+            for (const auto& pr : session)
+            {
+                if (pr.first >= num_actions)
+                    throw std::invalid_argument{"action id out of range"};
+            }
+        }
+    }
+}
+
+inline uint64_t
+num_training_sessions(const dm_mixture_model::training_data_type& training)
+{
+    uint64_t total = 0;
+    for (const auto& sequences : training)
+        total += sequences.size();
+    return total;
+}
+
+inline uint64_t num_training_sessions(const csr_training_data& training)
+{
+    return training.num_sessions();
+}
+
+/**
+ * Throws std::invalid_argument unless the training data has as many users
+ * and sessions as the data the model was initialized with.
+ */
+template <class Model, class TrainingData>
+void check_training_size(const Model& model, const TrainingData& training)
+{
+    if (training.size() != model.num_users())
+        throw std::invalid_argument{
+            "training data must have the model's number of users"};
+    if (num_training_sessions(training) != model.num_sessions())
+        throw std::invalid_argument{
+            "training data must have the model's number of sessions"};
+}
+
+/**
+ * Binds the constructors and methods shared by the sampler's model types.
+ */
+template <class Model>
+void bind_model(py::class_<Model>& cls)
+{
+    using options_type = typename Model::options_type;
+    using training_data_type = dm_mixture_model::training_data_type;
+    using array_type = csr_training_data::array_type;
+    cls.def(py::init([](const training_data_type& training,
+                         options_type opts, xoroshiro128& rng) {
+                check_action_ids(training, opts.num_actions);
+                return new Model(training, opts, rng);
+            }),
+            py::arg("training"), py::arg("options"), py::arg("rng"))
+        .def(py::init([](const array_type& user_offsets,
+                         const array_type& session_offsets,
+                         const array_type& action_ids, const array_type& counts,
+                         options_type opts, xoroshiro128& rng) {
+                 csr_training_data training{user_offsets, session_offsets,
+                                            action_ids, counts,
+                                            opts.num_actions};
+                 return new Model(training, opts, rng);
+             }),
+             py::arg("user_offsets"), py::arg("session_offsets"),
+             py::arg("action_ids"), py::arg("counts"), py::arg("options"),
+             py::arg("rng"))
+        .def("run",
+             [](Model& model, const training_data_type& training,
+                uint64_t num_iters, xoroshiro128& rng, py::function& progress,
+                uint64_t progress_every, double progress_interval,
+                const stopping_rule& stopping) {
+                 check_action_ids(training, model.num_actions());
+                 check_training_size(model, training);
+                 python_progress reporter{progress, progress_every,
+                                          progress_interval};
+                 py::gil_scoped_release release;
+                 model.run(training, num_iters, rng, reporter, stopping);
+             },
+             py::arg("training"), py::arg("num_iters"), py::arg("rng"),
+             py::arg("progress"), py::arg("progress_every") = 0,
+             py::arg("progress_interval") = 0.1,
+             py::arg("stopping") = stopping_rule{})
+        .def("run",
+             [](Model& model, const array_type& user_offsets,
+                const array_type& session_offsets, const array_type& action_ids,
+                const array_type& counts, uint64_t num_iters,
+                xoroshiro128& rng, py::function& progress,
+                uint64_t progress_every, double progress_interval,
+                const stopping_rule& stopping) {
+                 csr_training_data training{user_offsets, session_offsets,
+                                            action_ids, counts,
+                                            model.num_actions()};
+                 check_training_size(model, training);
+                 python_progress reporter{progress, progress_every,
+                                          progress_interval};
+                 py::gil_scoped_release release;
+                 model.run(training, num_iters, rng, reporter, stopping);
+             },
+             py::arg("user_offsets"), py::arg("session_offsets"),
+             py::arg("action_ids"), py::arg("counts"), py::arg("num_iters"),
+             py::arg("rng"), py::arg("progress"), py::arg("progress_every") = 0,
+             py::arg("progress_interval") = 0.1,
+             py::arg("stopping") = stopping_rule{})
+        .def("num_iterations", &Model::num_iterations)
+        .def("log_joint_likelihood", &Model::log_joint_likelihood)
+        .def("action_probability", &Model::action_probability)
+        .def("role_probability", &Model::role_probability)
+        .def("topic_assignment", &Model::topic_assignment);
+}
+
+/**
+ * Runs run_chains for the Model type with the GIL released, and hands the
+ * models over to Python.
+ */
+template <class Model>
+py::list run_python_chains(const csr_training_data& training,
+                           typename Model::options_type opts,
+                           uint64_t num_chains, uint64_t num_iters,
+                           xoroshiro128& rng, py::function& progress,
+                           const stopping_rule& stopping)
+{
+    std::vector<std::unique_ptr<Model>> models;
+    {
+        py::gil_scoped_release release;
+        models = run_chains<Model>(
+            training, opts, num_chains, num_iters, rng,
+            [&](uint64_t iter, uint64_t max_iter, uint64_t idx, uint64_t total,
+                double log_likelihood) {
+                py::gil_scoped_acquire acquire;
+                progress(iter, max_iter, idx, total, log_likelihood);
+            },
+            stopping);
+    }
+
+    py::list chains;
+    for (auto& model : models)
+    {
+        chains.append(py::cast(model.release(),
+                               py::return_value_policy::take_ownership));
+    }
+    return chains;
+}
+
 PYBIND11_MODULE(mdmm_sampler, m)
 {
     m.doc() = "Collapsed Gibbs sampler for MDMM behavior models";
@@ -368,37 +2004,100 @@ PYBIND11_MODULE(mdmm_sampler, m)
             return ss.str();
         });
 
+    using likelihood_kernel = dm_mixture_model::likelihood_kernel;
+    py::enum_<likelihood_kernel>{mdmm, "LikelihoodKernel"}
+        .value("product", likelihood_kernel::product)
+        .value("lgamma", likelihood_kernel::lgamma);
+
+    using backend = dm_mixture_model::backend;
+    py::enum_<backend>{mdmm, "Backend"}
+        .value("sparse", backend::sparse)
+        .value("dense", backend::dense);
+
     using options_type = dm_mixture_model::options_type;
     py::class_<options_type>{mdmm, "Options"}
         .def(py::init([](uint8_t num_topics, uint64_t num_actions, double alpha,
-                         double beta) {
+                         double beta, bool collapse_sessions,
+                         likelihood_kernel kernel, backend model_backend) {
                  options_type o{};
                  o.num_topics = num_topics;
                  o.num_actions = num_actions;
                  o.alpha = alpha;
                  o.beta = beta;
+                 o.collapse_sessions = collapse_sessions;
+                 o.kernel = kernel;
+                 o.model_backend = model_backend;
                  return o;
              }),
              py::arg("num_topics") = 5, py::arg("num_actions"),
-             py::arg("alpha") = 0.1, py::arg("beta") = 0.1)
+             py::arg("alpha") = 0.1, py::arg("beta") = 0.1,
+             py::arg("collapse_sessions") = false,
+             py::arg("kernel") = likelihood_kernel::product,
+             py::arg("backend") = backend::sparse)
         .def_readwrite("num_topics", &options_type::num_topics)
         .def_readwrite("num_actions", &options_type::num_actions)
         .def_readwrite("alpha", &options_type::alpha)
-        .def_readwrite("beta", &options_type::beta);
+        .def_readwrite("beta", &options_type::beta)
+        .def_readwrite("collapse_sessions", &options_type::collapse_sessions)
+        .def_readwrite("kernel", &options_type::kernel)
+        .def_readwrite("backend", &options_type::model_backend);
 
     auto rng_mod = m.def_submodule("random", "RNG facilities for the sampler");
 
-    py::class_<random::xoroshiro128>{rng_mod, "Xoroshiro128"}
+    py::class_<xoroshiro128>{rng_mod, "Xoroshiro128"}
         .def(py::init<uint64_t>())
         .def(py::init<uint64_t, uint64_t>())
-        .def("__call__", &random::xoroshiro128::operator());
+        .def("__call__", &xoroshiro128::operator())
+        .def("jump", &xoroshiro128::jump);
 
-    using training_data_type = dm_mixture_model::training_data_type;
-    mdmm.def(py::init<const training_data_type&, options_type,
-                      random::xoroshiro128&>())
-        .def("run",
-             &dm_mixture_model::run<random::xoroshiro128&, py::function&>)
-        .def("action_probability", &dm_mixture_model::action_probability)
-        .def("role_probability", &dm_mixture_model::role_probability)
-        .def("topic_assignment", &dm_mixture_model::topic_assignment);
+    py::class_<stopping_rule>{m, "StoppingRule"}
+        .def(py::init([](uint64_t burn_in, uint64_t window, double tolerance) {
+                 stopping_rule rule;
+                 rule.burn_in = burn_in;
+                 rule.window = window;
+                 rule.tolerance = tolerance;
+                 return rule;
+             }),
+             py::arg("burn_in") = 0, py::arg("window") = 0,
+             py::arg("tolerance") = 0.0)
+        .def_readwrite("burn_in", &stopping_rule::burn_in)
+        .def_readwrite("window", &stopping_rule::window)
+        .def_readwrite("tolerance", &stopping_rule::tolerance)
+        .def("converged", &stopping_rule::converged);
+
+    bind_model(mdmm);
+
+    py::class_<dense_mixture_model> dense{m, "DenseMDMM"};
+    bind_model(dense);
+
+    using array_type = csr_training_data::array_type;
+    m.def("run_chains",
+          [](const array_type& user_offsets, const array_type& session_offsets,
+             const array_type& action_ids, const array_type& counts,
+             options_type opts, uint64_t num_chains, uint64_t num_iters,
+             xoroshiro128& rng, py::function& progress,
+             const stopping_rule& stopping) {
+              if (num_chains == 0)
+                  throw std::invalid_argument{
+                      "num_chains must be at least 1"};
+              csr_training_data training{user_offsets, session_offsets,
+                                         action_ids, counts,
+                                         opts.num_actions};
+              if (opts.model_backend == backend::dense)
+              {
+                  return run_python_chains<dense_mixture_model>(
+                      training, opts, num_chains, num_iters, rng, progress,
+                      stopping);
+              }
+              return run_python_chains<dm_mixture_model>(
+                  training, opts, num_chains, num_iters, rng, progress,
+                  stopping);
+          },
+          "Fits several independent chains to the same training data in "
+          "parallel and returns their models, which are MDMMs or DenseMDMMs "
+          "depending on the backend in the options",
+          py::arg("user_offsets"), py::arg("session_offsets"),
+          py::arg("action_ids"), py::arg("counts"), py::arg("options"),
+          py::arg("num_chains"), py::arg("num_iters"), py::arg("rng"),
+          py::arg("progress"), py::arg("stopping") = stopping_rule{});
 }
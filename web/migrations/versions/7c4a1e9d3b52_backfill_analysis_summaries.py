@@ -0,0 +1,110 @@
+"""Backfill the summaries of older analyses
+
+Revision ID: 7c4a1e9d3b52
+Revises: 5b8f2c6e0d17
+Create Date: 2026-10-18 22:14:51.610394
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import numpy as np
+
+
+# revision identifiers, used by Alembic.
+revision = '7c4a1e9d3b52'
+down_revision = '5b8f2c6e0d17'
+branch_labels = None
+depends_on = None
+
+analysis_summary = sa.table('analysis_summary',
+                            sa.column('analysis_id', sa.Integer),
+                            sa.column('num_actions', sa.Integer),
+                            sa.column('num_sessions', sa.Integer),
+                            sa.column('num_users', sa.Integer),
+                            sa.column('length_avg', sa.Float),
+                            sa.column('length_std', sa.Float),
+                            sa.column('length_median', sa.Float),
+                            sa.column('length_p90', sa.Float),
+                            sa.column('length_max', sa.Integer),
+                            sa.column('length_histogram', sa.JSON),
+                            sa.column('action_type_counts', sa.JSON),
+                            sa.column('role_session_counts', sa.JSON))
+
+
+def upgrade():
+    # analyses that finished before summaries were kept have none; compute
+    # them the same way AnalysisSummary.compute does, so that viewing an
+    # analysis never has to
+    conn = op.get_bind()
+    analyses = conn.execute(sa.text("""
+        SELECT analysis.id, analysis.crawl_id, analysis.session_set_id
+        FROM analysis
+        LEFT JOIN analysis_summary
+            ON analysis_summary.analysis_id = analysis.id
+        WHERE analysis.finished AND analysis_summary.analysis_id IS NULL
+    """)).fetchall()
+
+    for analysis in analyses:
+        type_counts = conn.execute(sa.text("""
+            SELECT type_id, count(*) FROM action
+            WHERE crawl_id = :crawl_id
+            GROUP BY type_id
+        """), crawl_id=analysis.crawl_id).fetchall()
+        num_users = conn.execute(sa.text("""
+            SELECT count(DISTINCT user_id) FROM action
+            WHERE crawl_id = :crawl_id
+        """), crawl_id=analysis.crawl_id).scalar()
+        # a session is every action of its user within its time span
+        lengths = np.array([
+            row[0] for row in conn.execute(sa.text("""
+                SELECT count(action.id) FROM session
+                JOIN action
+                    ON action.crawl_id = :crawl_id
+                    AND action.user_id = session.user_id
+                    AND action.time BETWEEN session.start_time
+                                        AND session.end_time
+                WHERE session.session_set_id = :session_set_id
+                GROUP BY session.id
+            """), crawl_id=analysis.crawl_id,
+                session_set_id=analysis.session_set_id)
+        ], dtype=np.int64)
+        role_counts = conn.execute(sa.text("""
+            SELECT session_role.role_id, count(*) FROM session_role
+            JOIN role ON role.id = session_role.role_id
+            WHERE role.analysis_id = :analysis_id
+            GROUP BY session_role.role_id
+        """), analysis_id=analysis.id).fetchall()
+
+        summary = {
+            'analysis_id': analysis.id,
+            'num_actions': sum(count for _, count in type_counts),
+            'num_sessions': len(lengths),
+            'num_users': num_users,
+            'length_histogram': np.bincount(lengths)[1:].tolist(),
+            'action_type_counts': {
+                str(type_id): count
+                for type_id, count in sorted(type_counts)
+            },
+            'role_session_counts': {
+                str(role_id): count
+                for role_id, count in role_counts
+            },
+            'length_avg': None,
+            'length_std': None,
+            'length_median': None,
+            'length_p90': None,
+            'length_max': None
+        }
+        if len(lengths):
+            summary['length_avg'] = float(lengths.mean())
+            summary['length_std'] = float(lengths.std())
+            summary['length_median'] = float(np.median(lengths))
+            summary['length_p90'] = float(np.percentile(lengths, 90))
+            summary['length_max'] = int(lengths.max())
+        conn.execute(analysis_summary.insert().values(summary))
+
+
+def downgrade():
+    # the summaries are still valid for the older revisions, which compute
+    # them when they're missing
+    pass
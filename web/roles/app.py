@@ -14,7 +14,8 @@ def create_app(use_eventlet=True):
     envvars = [
         'SECRET_KEY', 'FLASK_ENV', 'SQLALCHEMY_DATABASE_URI',
         'SQLALCHEMY_TRACK_MODIFICATIONS', 'CELERY_RESULT_BACKEND',
-        'CELERY_BROKER_URL'
+        'CELERY_BROKER_URL', 'CRAWL_RATE', 'CRAWL_CONCURRENCY',
+        'CRAWL_SHARDS', 'ACTION_BATCH_SIZE', 'SNAPSHOT_DIR'
     ]
     for envvar in envvars:
         app.config[envvar] = os.getenv(envvar)
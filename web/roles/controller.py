@@ -86,7 +86,7 @@ def login():
     email = request.form['email']
     password = request.form['password']
 
-    piazza_rpc = piazza_api.rpc.PiazzaRPC()
+    piazza_rpc = make_piazza_rpc()
     error = None
     try:
         piazza_rpc.user_login(email, password)
@@ -195,7 +195,7 @@ def start_crawl_class(network_id):
         email = request.form['email']
         password = request.form['password']
 
-        piazza_rpc = piazza_api.rpc.PiazzaRPC()
+        piazza_rpc = make_piazza_rpc()
         piazza_rpc.user_login(email, password)
         piazza = piazza_api.Piazza(piazza_rpc)
         net = piazza.network(g.network.nid)
@@ -204,22 +204,67 @@ def start_crawl_class(network_id):
         flash('Could not communicate with Piazza. Try again?', 'danger')
         return render_template('crawl.html', network=g.network)
 
-    if g.network.crawl:
-        db.session.delete(g.network.crawl)
+    # An incremental crawl keeps the existing crawl (and its analyses) and
+    # only re-fetches posts that are new or have changed. This requires the
+    # previous crawl to have recorded which posts it saw.
+    incremental = (request.form.get('incremental') and g.network.crawl
+                   and g.network.crawl.finished and g.network.crawl.posts)
+
+    # Resuming picks an unfinished crawl back up from its last committed
+    # batch, e.g. after the worker running it was restarted.
+    resume = (request.form.get('resume') and g.network.crawl
+              and not g.network.crawl.finished)
+
+    if resume:
+        crawl = g.network.crawl
+        # make sure the old task isn't still running alongside the new one
+        if crawl.task_id:
+            celery.control.revoke(crawl.task_id, terminate=True)
+    elif incremental:
+        crawl = g.network.crawl
+        crawl.finished = False
         db.session.commit()
+    else:
+        if g.network.crawl:
+            g.network.crawl.delete()
+            db.session.commit()
 
-    crawl = Crawl(network=g.network)
-    db.session.add(crawl)
-    db.session.commit()
+        crawl = Crawl(
+            network=g.network,
+            store_content=not request.form.get('skip_content'))
+        db.session.add(crawl)
+        db.session.commit()
 
     cookiejar = requests.utils.dict_from_cookiejar(piazza_rpc.session.cookies)
-    task = crawl_course.delay(crawl.id, cookiejar)
+    task = crawl_course.delay(
+        crawl.id,
+        cookiejar,
+        incremental=bool(incremental),
+        resume=bool(resume))
     crawl.task_id = task.id
     db.session.commit()
 
     return render_template('crawl.html', network=g.network)
 
 
+@bp.route('/class/<network_id>/crawl/rebuild', methods=['POST'])
+@login_required
+@network_required
+def rebuild_crawl_actions(network_id):
+    crawl = g.network.crawl
+    if not crawl or not crawl.finished or not crawl.can_rebuild_actions():
+        abort(404)
+
+    crawl.finished = False
+    db.session.commit()
+
+    task = rebuild_actions.delay(crawl.id)
+    crawl.task_id = task.id
+    db.session.commit()
+
+    return redirect(url_for('.crawl_class', network_id=network_id))
+
+
 @bp.route('/class/<network_id>/analysis', methods=['GET', 'POST'])
 @login_required
 @network_required
@@ -232,6 +277,8 @@ def new_analysis(network_id):
             session_gap=form.session_gap.data,
             role_count=form.role_count.data,
             max_iterations=form.max_iterations.data,
+            min_iterations=form.min_iterations.data,
+            num_chains=form.num_chains.data,
             proportion_smoothing=form.proportion_smoothing.data,
             role_smoothing=form.role_smoothing.data)
         db.session.add(analysis)
@@ -244,7 +291,29 @@ def new_analysis(network_id):
         return redirect(
             url_for(
                 '.analysis', network_id=network_id, analysis_id=analysis.id))
-    return render_template('new_analysis.html', network=g.network, form=form)
+
+    # comparing the sessions produced by a few session gaps helps with
+    # choosing one before committing to a full analysis
+    sweep_form = SessionGapSweepForm(formdata=request.args or None)
+    snapshot = None
+    sweep = None
+    if g.network.crawl and g.network.crawl.finished:
+        # the snapshot is taken when the crawl finishes; if it has gone
+        # missing since, it's taken again in the background rather than
+        # making this request wait for it
+        snapshot = g.network.crawl.load_snapshot()
+        if snapshot is None:
+            take_snapshot.delay(g.network.crawl.id)
+        elif sweep_form.validate():
+            sweep = snapshot.sweep(sweep_form.session_gaps)
+
+    return render_template(
+        'new_analysis.html',
+        network=g.network,
+        form=form,
+        sweep_form=sweep_form,
+        snapshot=snapshot,
+        sweep=sweep)
 
 
 @bp.route('/class/<network_id>/analysis/<analysis_id>')
@@ -258,7 +327,7 @@ def analysis(network_id, analysis_id):
         'network': g.network,
         'analysis': g.analysis,
         'progress': g.analysis.progress(),
-        'total_users': g.network.crawl.total_users()
+        'summary': None
     }
 
     view['action_type_map'] = {
@@ -276,17 +345,24 @@ def analysis(network_id, analysis_id):
             for role in g.analysis.roles
         }
 
-    session_stats = []
-    session_stats.append(('Total actions', len(g.network.crawl.actions)))
-    session_stats.append(('Total sessions', len(g.analysis.sessions)))
-    session_stats.append(('Total users', g.network.crawl.total_users()))
-
-    length_stats = g.analysis.session_length_stats()
-    session_stats.append(('Average session length (actions)',
-                          length_stats.avg))
-    session_stats.append(('Standard deviation (actions)', length_stats.std))
-
-    view['session_stats'] = session_stats
+        summary = g.analysis.get_summary()
+        view['summary'] = summary
+
+        session_stats = []
+        session_stats.append(('Total actions', summary.num_actions))
+        session_stats.append(('Total sessions', summary.num_sessions))
+        session_stats.append(('Total users', summary.num_users))
+        session_stats.append(('Average session length (actions)',
+                              summary.length_avg))
+        session_stats.append(('Standard deviation (actions)',
+                              summary.length_std))
+        session_stats.append(('Median session length (actions)',
+                              summary.length_median))
+        session_stats.append(('90th percentile (actions)',
+                              summary.length_p90))
+        session_stats.append(('Longest session (actions)',
+                              summary.length_max))
+        view['session_stats'] = session_stats
 
     return render_template('analysis.html', **view)
 
@@ -323,26 +399,31 @@ def role(network_id, analysis_id, role_num):
     # (uid, weight, session_count)
 
     session_count = func.count(Session.id)
-    proportions = db.session.query(RoleProportion.uid,
+    proportions = db.session.query(CrawlUser.uid,
                                    RoleProportion.weight,
                                    session_count.label('session_count'))\
-                            .filter(RoleProportion.uid == Session.uid)\
-                            .filter(RoleProportion.role_id == Session.role_id)\
+                            .filter(CrawlUser.id == RoleProportion.user_id)\
+                            .filter(RoleProportion.user_id ==
+                                    Session.user_id)\
+                            .filter(Session.id == session_role.c.session_id)\
+                            .filter(RoleProportion.role_id ==
+                                    session_role.c.role_id)\
                             .filter(RoleProportion.role_id == role.id)\
-                            .group_by(RoleProportion.uid,
+                            .group_by(CrawlUser.uid,
                                       RoleProportion.weight)\
                             .order_by(RoleProportion.weight.desc())\
                             .all()
 
     sessions = db.session.query(Session, RoleProportion)\
-            .filter(Session.analysis_id == analysis_id)\
-            .filter(Session.role_id == role.id)\
-            .filter(Session.uid == RoleProportion.uid)\
-            .filter(Session.role_id == RoleProportion.role_id)\
+            .filter(Session.id == session_role.c.session_id)\
+            .filter(session_role.c.role_id == role.id)\
+            .filter(Session.user_id == RoleProportion.user_id)\
+            .filter(RoleProportion.role_id == role.id)\
             .order_by(RoleProportion.weight.desc())\
-            .order_by(Session.uid)\
+            .order_by(Session.user_id)\
             .order_by(Session.id)\
             .all()
+    Session.load_actions([session for session, _ in sessions])
 
     role_json = [aw.weight for aw in role.weights]
 
@@ -358,6 +439,7 @@ def role(network_id, analysis_id, role_num):
         'role.html',
         network=g.network,
         analysis=g.analysis,
+        summary=g.analysis.get_summary(),
         role=role,
         role_num=role_num,
         proportions=proportions,
@@ -385,14 +467,26 @@ def uid_dlc(*args, **kwargs):
     '',
     dynamic_list_constructor=uid_dlc)
 def user(network_id, analysis_id, uid):
+    crawl_user = CrawlUser.query.filter_by(
+        crawl_id=g.analysis.crawl_id, uid=uid).first()
+    if crawl_user is None:
+        abort(404)
+
     proportions = RoleProportion.query.filter_by(analysis=g.analysis)\
-            .filter_by(uid=uid)\
+            .filter_by(user_id=crawl_user.id)\
             .order_by(RoleProportion.role_id)
     proportions = [prop.weight for prop in proportions]
 
-    sessions = Session.query.filter_by(analysis=g.analysis)\
-            .filter_by(uid=uid)\
+    session_roles = db.session.query(Session, session_role.c.role_id)\
+            .filter(Session.session_set_id == g.analysis.session_set_id)\
+            .filter(Session.user_id == crawl_user.id)\
+            .filter(Session.id == session_role.c.session_id)\
+            .filter(Role.id == session_role.c.role_id)\
+            .filter(Role.analysis_id == g.analysis.id)\
+            .order_by(Session.id)\
             .all()
+    sessions = [session for session, _ in session_roles]
+    Session.load_actions(sessions)
 
     role_number = {
         role.id: g.analysis.roles.index(role) + 1
@@ -409,5 +503,7 @@ def user(network_id, analysis_id, uid):
         uid=uid,
         proportions=proportions,
         sessions=sessions,
+        session_roles=dict(
+            (session.id, role_id) for session, role_id in session_roles),
         role_number=role_number,
         ActionType=ActionType)
@@ -1,6 +1,10 @@
 from flask_wtf import FlaskForm
-from wtforms import DecimalField, IntegerField
-from wtforms.validators import DataRequired, NumberRange
+import math
+from wtforms import DecimalField, IntegerField, StringField
+from wtforms.validators import DataRequired, NumberRange, ValidationError
+
+DEFAULT_SWEEP_GAPS = '0.5, 1, 2, 3, 6, 12, 24, 48'
+MAX_SWEEP_GAPS = 20
 
 
 class AnalysisForm(FlaskForm):
@@ -27,6 +31,23 @@ class AnalysisForm(FlaskForm):
             'max': '5000'
         })
 
+    min_iterations = IntegerField(
+        'Minimum iterations',
+        validators=[DataRequired(),
+                    NumberRange(min=100, max=5000)],
+        render_kw={
+            'min': '100',
+            'max': '5000'
+        })
+
+    num_chains = IntegerField(
+        'Number of chains',
+        validators=[DataRequired(), NumberRange(min=1, max=16)],
+        render_kw={
+            'min': '1',
+            'max': '16'
+        })
+
     proportion_smoothing = DecimalField(
         'Proportion smoothing',
         places=2,
@@ -44,3 +65,52 @@ class AnalysisForm(FlaskForm):
             'step': '0.01',
             'min': '0.01'
         })
+
+    def validate_min_iterations(form, field):
+        if form.max_iterations.data is None:
+            return
+        if field.data > form.max_iterations.data:
+            raise ValidationError(
+                'Must not be more than the number of iterations.')
+
+
+def parse_session_gaps(text):
+    """
+    Parses a comma-separated list of session gap lengths in hours, raising
+    a ValueError describing the first one that isn't valid.
+    """
+    gaps = []
+    for value in text.split(','):
+        value = value.strip()
+        if not value:
+            continue
+        try:
+            gap = float(value)
+        except ValueError:
+            raise ValueError('"{}" is not a number.'.format(value))
+        if not math.isfinite(gap) or gap <= 0:
+            raise ValueError(
+                '"{}" is not a positive number of hours.'.format(value))
+        gaps.append(gap)
+
+    if not gaps:
+        raise ValueError('Enter at least one session gap length.')
+    if len(gaps) > MAX_SWEEP_GAPS:
+        raise ValueError('At most {} session gap lengths can be compared at '
+                         'once.'.format(MAX_SWEEP_GAPS))
+    return gaps
+
+
+class SessionGapSweepForm(FlaskForm):
+    # submitted with GET, so there's nothing to protect with a CSRF token
+    class Meta:
+        csrf = False
+
+    gaps = StringField(
+        'Session gap lengths (hours)', default=DEFAULT_SWEEP_GAPS)
+
+    def validate_gaps(form, field):
+        try:
+            form.session_gaps = parse_session_gaps(field.data or '')
+        except ValueError as e:
+            raise ValidationError(str(e))
@@ -1,12 +1,33 @@
 from celery.result import AsyncResult
+import collections
 from datetime import datetime, timedelta
 from enum import IntEnum, auto
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import distinct, func
+from sqlalchemy import distinct, event, func
+from sqlalchemy.dialects.postgresql import insert
+from werkzeug.utils import cached_property
+import hashlib
+import json
 import mdmm_sampler
+import numpy as np
+import os
+import tempfile
+import zlib
+
+from .snapshot import ActionSnapshot
 
 db = SQLAlchemy()
 
+# the number of rows written by each statement when inserting in bulk
+BULK_INSERT_SIZE = 10000
+
+# after its burn-in, a sampling chain stops once the mean log joint
+# likelihood of its last CONVERGENCE_WINDOW iterations is within
+# CONVERGENCE_TOLERANCE (relative) of that of the window before
+CONVERGENCE_WINDOW = 50
+CONVERGENCE_TOLERANCE = 1e-4
+
 network_user = db.Table(
     'network_user',
     db.Column(
@@ -59,6 +80,14 @@ class Crawl(db.Model):
         backref=db.backref('crawl', lazy=True),
         cascade='all, delete-orphan')
     num_fully_anon = db.Column(db.Integer, nullable=False, server_default="0")
+    # checkpoint of how far through the feed the crawl has committed, so a
+    # crawl can report progress (and be resumed) after its worker dies
+    feed_position = db.Column(db.Integer, nullable=False, server_default="0")
+    total_posts = db.Column(db.Integer, nullable=True)
+    # whether the text of each action is kept; the analyses only need the
+    # action types, so large courses can be crawled without it
+    store_content = db.Column(
+        db.Boolean, nullable=False, server_default=db.true())
 
     def __repr__(self):
         return "<Crawl: {}>".format(self.id)
@@ -66,6 +95,8 @@ class Crawl(db.Model):
     def progress(self):
         if self.finished:
             return 100
+        if self.total_posts:
+            return 100 * float(self.feed_position) / self.total_posts
         try:
             result = AsyncResult(self.task_id)
             if result.state == 'PROGRESS':
@@ -76,91 +107,440 @@ class Crawl(db.Model):
 
     def total_users(self):
         return Action.query.filter_by(crawl=self)\
-                .with_entities(func.count(distinct(Action.uid)))\
+                .with_entities(func.count(distinct(Action.user_id)))\
                 .scalar()
 
-    def increment_fully_anon(self):
-        self.num_fully_anon += 1
-        if self.num_fully_anon == 1:
+    def snapshot_version(self):
+        # every crawl, resume or rebuild of a crawl runs as a new task, so
+        # the task id identifies the set of actions a snapshot was taken of
+        return self.task_id or 'none'
+
+    def snapshot_path(self):
+        directory = current_app.config.get('SNAPSHOT_DIR') or os.path.join(
+            tempfile.gettempdir(), 'roles-snapshots')
+        return os.path.join(directory, 'crawl-{}.{}'.format(
+            self.id, self.snapshot_version()))
+
+    def load_snapshot(self):
+        """
+        Returns the snapshot of this crawl's actions, or None if it hasn't
+        been taken yet.
+        """
+        return ActionSnapshot.load(self.snapshot_path())
+
+    def snapshot(self):
+        """
+        Returns the snapshot of this crawl's actions used by its analyses,
+        taking it first if it doesn't exist yet.
+        """
+        snapshot = self.load_snapshot()
+        if snapshot is None:
+            path = self.snapshot_path()
+            rows = db.session.query(
+                    Action.user_id,
+                    db.cast(func.extract('epoch', Action.time),
+                            db.BigInteger),
+                    Action.type_id,
+                    Action.id)\
+                    .filter(Action.crawl_id == self.id)\
+                    .order_by(Action.user_id, Action.time, Action.id)\
+                    .yield_per(10000)
+            snapshot = ActionSnapshot.build(path, rows)
+        return snapshot
+
+    def advance_feed_position(self, count):
+        stmt = Crawl.__table__.update()\
+                .where(Crawl.id == self.id)\
+                .values(feed_position=Crawl.feed_position + count)\
+                .returning(Crawl.feed_position)
+        feed_position = db.session.execute(stmt).scalar()
+        db.session.expire(self, ['feed_position'])
+        return feed_position
+
+    def delete_post_actions(self, post_id):
+        """
+        Deletes the actions of one of the crawl's posts and returns the
+        digests of their content, which may no longer be needed.
+        """
+        stmt = Action.__table__.delete()\
+                .where(Action.crawl_id == self.id)\
+                .where(Action.post_id == post_id)\
+                .returning(Action.content_digest)
+        return {digest for digest, in db.session.execute(stmt) if digest}
+
+    def replace_post_actions(self, writer, post):
+        """
+        Replaces the actions of one of the crawl's posts that has changed
+        since it was crawled, keeping the actions still found in it rather
+        than deleting and recreating them, so that the sessions of earlier
+        analyses still find them. Returns the digests of the content of the
+        actions that were deleted, which may no longer be needed.
+        """
+        actions = classify_post(post, with_content=self.store_content)
+        digests = [ActionContent.digest_of(text) for text in actions.content]
+
+        existing = collections.defaultdict(list)
+        rows = db.session.query(Action.id, CrawlUser.uid, Action.type_id,
+                                Action.time, Action.content_digest)\
+                .join(CrawlUser, CrawlUser.id == Action.user_id)\
+                .filter(Action.crawl_id == self.id)\
+                .filter(Action.post_id == post['id'])\
+                .order_by(Action.id)
+        for action_id, uid, type_id, time, digest in rows:
+            existing[(uid, type_id, time, digest)].append(action_id)
+
+        added = []
+        for i, key in enumerate(
+                zip(actions.uid, actions.type_id, actions.time, digests)):
+            if existing.get(key):
+                existing[key].pop(0)
+            else:
+                added.append(i)
+        writer.add_actions(actions.select(added))
+        if actions.num_fully_anon:
+            self.increment_fully_anon(actions.num_fully_anon)
+
+        removed = [
+            action_id for action_ids in existing.values()
+            for action_id in action_ids
+        ]
+        if not removed:
+            return set()
+        stmt = Action.__table__.delete()\
+                .where(Action.id.in_(removed))\
+                .returning(Action.content_digest)
+        return {digest for digest, in db.session.execute(stmt) if digest}
+
+    def can_rebuild_actions(self):
+        # a single query, rather than loading every CrawlPost of the crawl
+        posts = CrawlPost.query.filter(CrawlPost.crawl_id == self.id)
+        missing = posts.filter(CrawlPost.digest.is_(None))
+        return db.session.query(posts.exists() & ~missing.exists()).scalar()
+
+    def clear_actions(self):
+        """
+        Deletes the crawl's actions and everything derived from them,
+        returning the digests of the content the actions referred to.
+        """
+        # analyses refer to the actions through their sessions, so they
+        # can't outlive them
+        for analysis in self.analyses:
+            db.session.delete(analysis)
+        db.session.flush()
+
+        stmt = Action.__table__.delete()\
+                .where(Action.crawl_id == self.id)\
+                .returning(Action.content_digest)
+        content_digests = {
+            digest
+            for digest, in db.session.execute(stmt) if digest
+        }
+        CrawlError.query.filter_by(crawl_id=self.id,
+                                   message=CrawlError.FULLY_ANON_MESSAGE)\
+                .delete(synchronize_session=False)
+        self.num_fully_anon = 0
+        return content_digests
+
+    def delete(self):
+        """
+        Deletes the crawl along with any content and raw posts that no
+        other crawl refers to.
+        """
+        content_digests = self.clear_actions()
+        raw_post_digests = [post.digest for post in self.posts]
+        db.session.delete(self)
+        db.session.flush()
+        ActionContent.collect_garbage(content_digests)
+        RawPost.collect_garbage(raw_post_digests)
+
+    def increment_fully_anon(self, count=1):
+        # Several workers may be creating actions for the same crawl at
+        # once, so the counter has to be incremented in the database rather
+        # than on this (possibly stale) object.
+        stmt = Crawl.__table__.update()\
+                .where(Crawl.id == self.id)\
+                .values(num_fully_anon=Crawl.num_fully_anon + count)\
+                .returning(Crawl.num_fully_anon)
+        num_fully_anon = db.session.execute(stmt).scalar()
+        db.session.expire(self, ['num_fully_anon'])
+
+        if num_fully_anon == count:
             CrawlError.create_fully_anon(self)
 
-    def create_actions_from_history(self, parent, post):
-        #
-        # history is in reverse-chronological order
-        #
-        for idx, item in enumerate(reversed(post['history'])):
-            try:
-                type_id = ActionType.from_post_history(
-                    parent, post, item, is_edit=(idx != 0))
-
-                time = datetime.strptime(item['created'], '%Y-%m-%dT%H:%M:%SZ')
-
-                if item['subject'] and len(item['subject']) != 0:
-                    content = "\n".join([item['subject'], item['content']])
-                else:
-                    content = item['content']
-
-                action = Action(
-                    crawl_id=self.id,
-                    uid=item['uid'],
-                    type_id=int(type_id),
-                    time=time,
-                    content=content)
-                db.session.add(action)
-            except KeyError as error:
-                key = error.args[0]
-                if key == 'uid':
-                    self.increment_fully_anon()
-                else:
-                    raise
-
-    def create_actions_from_followup(self, parent, post, child=None):
-        #
-        # because feedback and followup content types are basically the
-        # same, we can re-use this function for both. If child is none,
-        # then it is a root "followup", otherwise it is a "feedback"
-        # comment.
-        #
-        try:
-            if child:
-                type_id = ActionType.feedback_action_type(parent, post, child)
-                content = child
-            else:
-                type_id = ActionType.followup_action_type(parent, post)
-                content = post
-
-            time = datetime.strptime(post['created'], '%Y-%m-%dT%H:%M:%SZ')
-            action = Action(
-                crawl_id=self.id,
-                uid=content['uid'],
-                type_id=int(type_id),
-                time=time,
-                content=content['subject'])
-            db.session.add(action)
-        except KeyError as error:
-            key = error.args[0]
-            if key == 'uid':
-                self.increment_fully_anon()
-            else:
-                raise
+    def create_actions_from_post(self, writer, post):
+        actions = classify_post(post, with_content=self.store_content)
+        writer.add_actions(actions)
+        if actions.num_fully_anon:
+            self.increment_fully_anon(actions.num_fully_anon)
+
+
+class ActionWriter(object):
+    """
+    Buffers the actions created for a crawl and writes them out in batches,
+    each with a single multi-row INSERT, instead of creating an ORM object
+    for every action and committing after every post.
+
+    Posts recorded with `add_post` are written in the same transaction as
+    the batch holding their actions, along with the crawl's
+    `feed_position` checkpoint, so a post is only ever marked as crawled
+    once all of its actions have been committed. The checkpoint is
+    incremented in the database so that several writers can work on the
+    same crawl at once.
+    """
+
+    def __init__(self, crawl, batch_size=1000):
+        self.crawl = crawl
+        self.batch_size = batch_size
+        self.actions = ActionColumns()
+        # the CrawlUser ids of the uids seen so far
+        self.user_ids = {}
+        self.posts = []
+        self.posts_finished = 0
+        self.committed_position = crawl.feed_position
+
+    @property
+    def feed_position(self):
+        return self.committed_position + self.posts_finished
+
+    def add_actions(self, actions):
+        self.actions.extend(actions)
+
+    def add_post(self, post_id, modified, digest=None):
+        self.posts.append((post_id, modified, digest))
+
+    def post_finished(self):
+        self.posts_finished += 1
+        if len(self.actions) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.actions:
+            rows = self.actions.rows(crawl_id=self.crawl.id)
+            # interned ids are only cached once their batch has committed,
+            # so the ones new to this batch are kept apart until then
+            interned = collections.ChainMap({}, self.user_ids)
+            user_ids = CrawlUser.intern(
+                self.crawl.id, self.actions.uid, known=interned)
+            for row, user_id in zip(rows, user_ids):
+                row['user_id'] = user_id
+            if self.crawl.store_content:
+                digests = ActionContent.store(self.actions.content)
+                for row, digest in zip(rows, digests):
+                    row['content_digest'] = digest
+            for i in range(0, len(rows), self.batch_size):
+                batch = rows[i:i + self.batch_size]
+                db.session.execute(Action.__table__.insert().values(batch))
+
+        if self.posts:
+            stmt = insert(CrawlPost.__table__)
+            stmt = stmt.values([{
+                'crawl_id': self.crawl.id,
+                'post_id': post_id,
+                'modified': modified,
+                'digest': digest
+            } for post_id, modified, digest in self.posts])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['crawl_id', 'post_id'],
+                set_={
+                    'modified': stmt.excluded.modified,
+                    'digest': stmt.excluded.digest
+                })
+            db.session.execute(stmt)
+
+        if self.posts_finished:
+            self.committed_position = self.crawl.advance_feed_position(
+                self.posts_finished)
+            self.posts_finished = 0
 
-        if not child:
-            for child in post['children']:
-                self.create_actions_from_followup(parent, post, child)
+        db.session.commit()
+        if self.actions:
+            self.user_ids.update(interned.maps[0])
+        self.actions = ActionColumns()
+        self.posts = []
 
-    def create_actions_from_post(self, post):
-        #
-        # there are two layers:
-        # root['children'] == ir, sr, followups
-        # followup['children] == feedback
-        #
-        self.create_actions_from_history(post, post)
 
-        for child in post['children']:
-            if child['type'] == 'i_answer' or child['type'] == 's_answer':
-                self.create_actions_from_history(post, child)
-            else:
-                self.create_actions_from_followup(post, child)
+class CrawlPost(db.Model):
+    crawl_id = db.Column(
+        db.Integer, db.ForeignKey('crawl.id'), primary_key=True)
+    crawl = db.relationship(
+        'Crawl',
+        backref=db.backref('posts', lazy=True, cascade='all, delete-orphan'))
+    post_id = db.Column(db.String(20), primary_key=True)
+    # the modification time reported for the post in the feed when it was
+    # last crawled, used to decide which posts need to be re-fetched
+    modified = db.Column(db.DateTime)
+    digest = db.Column(
+        db.String(40), db.ForeignKey('raw_post.digest'), nullable=True)
+    raw_post = db.relationship('RawPost')
+
+    def __repr__(self):
+        return "<CrawlPost: {}:{}>".format(self.crawl_id, self.post_id)
+
+
+class RawPost(db.Model):
+    """
+    The raw JSON of a post as returned by Piazza, compressed and keyed by
+    the SHA-1 of its contents so that identical posts are only stored once
+    across crawls. Keeping these around lets us re-derive the actions for
+    a crawl without having to go back to Piazza.
+    """
+    digest = db.Column(db.String(40), primary_key=True)
+    post_id = db.Column(db.String(20), nullable=False, index=True)
+    payload = db.deferred(db.Column(db.LargeBinary, nullable=False))
+
+    def __repr__(self):
+        return "<RawPost: {}:{}>".format(self.post_id, self.digest)
+
+    def post(self):
+        return json.loads(zlib.decompress(self.payload).decode('utf-8'))
+
+    @staticmethod
+    def store(post, with_content=True):
+        """
+        Stores the post if an identical one isn't stored already and
+        returns its digest. Without `with_content`, the text of the post is
+        stripped out first (see strip_post_content).
+        """
+        if not with_content:
+            post = strip_post_content(post)
+        data = json.dumps(
+            post, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        digest = hashlib.sha1(data).hexdigest()
+
+        stmt = insert(RawPost.__table__)\
+                .values(digest=digest,
+                        post_id=post['id'],
+                        payload=zlib.compress(data))\
+                .on_conflict_do_nothing(index_elements=['digest'])
+        db.session.execute(stmt)
+        return digest
+
+    @staticmethod
+    def collect_garbage(digests, batch_size=1000):
+        """
+        Deletes the raw posts with the given digests that no crawled post
+        refers to any more.
+        """
+        digests = sorted({digest for digest in digests if digest})
+        for i in range(0, len(digests), batch_size):
+            referenced = db.session.query(CrawlPost.post_id)\
+                    .filter(CrawlPost.digest == RawPost.digest)
+            RawPost.query\
+                    .filter(RawPost.digest.in_(digests[i:i + batch_size]))\
+                    .filter(~referenced.exists())\
+                    .delete(synchronize_session=False)
+
+
+class CrawlUser(db.Model):
+    """
+    The users seen during a crawl. Actions, sessions and role proportions
+    refer to users by the integer id here rather than repeating the uid.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    crawl_id = db.Column(db.Integer, db.ForeignKey('crawl.id'), nullable=False)
+    crawl = db.relationship(
+        'Crawl',
+        backref=db.backref('users', lazy=True, cascade='all, delete-orphan'))
+    uid = db.Column(db.String(120), nullable=False)
+
+    __table_args__ = (db.UniqueConstraint('crawl_id', 'uid'), )
+
+    def __repr__(self):
+        return "<CrawlUser: {}:{}>".format(self.crawl_id, self.uid)
+
+    @staticmethod
+    def intern(crawl_id, uids, known=None, batch_size=1000):
+        """
+        Adds every uid not already in the table for the crawl and returns
+        their ids, in order. `known` is an optional mapping of uids to ids
+        that is consulted first and updated with any ids looked up.
+        """
+        if known is None:
+            known = {}
+        # new uids are inserted in sorted order so that concurrent writers
+        # take the locks on the (crawl_id, uid) unique index in the same
+        # order and can't deadlock each other
+        missing = sorted({uid for uid in uids if uid not in known})
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i:i + batch_size]
+            stmt = insert(CrawlUser.__table__)\
+                    .values([{'crawl_id': crawl_id, 'uid': uid}
+                             for uid in batch])\
+                    .on_conflict_do_nothing(
+                        index_elements=['crawl_id', 'uid'])
+            db.session.execute(stmt)
+            rows = db.session.query(CrawlUser.uid, CrawlUser.id)\
+                    .filter(CrawlUser.crawl_id == crawl_id)\
+                    .filter(CrawlUser.uid.in_(batch))
+            known.update(rows)
+        return [known[uid] for uid in uids]
+
+
+class ActionContent(db.Model):
+    """
+    The text of an action, compressed and keyed by the SHA-1 of the text so
+    that it is only stored once no matter how many actions (e.g. repeated
+    crawls of the same post) share it.
+    """
+    digest = db.Column(db.String(40), primary_key=True)
+    body = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return "<ActionContent: {}>".format(self.digest)
+
+    def text(self):
+        return zlib.decompress(self.body).decode('utf-8')
+
+    @staticmethod
+    def digest_of(text):
+        """The digest `text` is stored under, or None for None."""
+        if text is None:
+            return None
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def store(texts, batch_size=1000):
+        """
+        Stores every text not already in the table and returns the digests
+        of all of them, in order. None has no digest.
+        """
+        digests = []
+        bodies = {}
+        for text in texts:
+            if text is None:
+                digests.append(None)
+                continue
+            digest = ActionContent.digest_of(text)
+            if digest not in bodies:
+                bodies[digest] = text.encode('utf-8')
+            digests.append(digest)
+
+        values = [{
+            'digest': digest,
+            'body': zlib.compress(data)
+        } for digest, data in bodies.items()]
+        for i in range(0, len(values), batch_size):
+            stmt = insert(ActionContent.__table__)\
+                    .values(values[i:i + batch_size])\
+                    .on_conflict_do_nothing(index_elements=['digest'])
+            db.session.execute(stmt)
+        return digests
+
+    @staticmethod
+    def collect_garbage(digests, batch_size=1000):
+        """
+        Deletes the content with the given digests that no action refers
+        to any more.
+        """
+        digests = sorted({digest for digest in digests if digest})
+        for i in range(0, len(digests), batch_size):
+            referenced = db.session.query(Action.id)\
+                    .filter(Action.content_digest == ActionContent.digest)
+            ActionContent.query\
+                    .filter(ActionContent.digest.in_(
+                        digests[i:i + batch_size]))\
+                    .filter(~referenced.exists())\
+                    .delete(synchronize_session=False)
 
 
 class CrawlError(db.Model):
@@ -168,27 +548,28 @@ class CrawlError(db.Model):
     crawl_id = db.Column(db.Integer, db.ForeignKey('crawl.id'), nullable=False)
     message = db.Column(db.Text, nullable=False)
 
+    FULLY_ANON_MESSAGE = (
+        "At least one action was performed while fully "
+        "anonymous (anonymous to instructors). This makes it "
+        "impossible to determine which student performed the "
+        "action, so it cannot be added to a session or be used "
+        "to determine ownership of content for other dependent "
+        "actions. This might be OK if only a small portion of "
+        "the actions were performed this way, but you may want "
+        "to check the percentage of fully anonymous actions "
+        "after the crawl has completed to determine whether that "
+        "percentage of data loss is acceptable to you. To prevent "
+        "this in the future, you can disable fully anonymous "
+        "(anonymous to instructors) posting in your Piazza course "
+        "in the \"Manage Course\" tab on their website.")
+
     def __repr__(self):
         return "<CrawlError: {}>".format(self.id)
 
     @staticmethod
     def create_fully_anon(crawl):
         error = CrawlError(
-            crawl_id=crawl.id,
-            message=(
-                "At least one action was performed while fully "
-                "anonymous (anonymous to instructors). This makes it "
-                "impossible to determine which student performed the "
-                "action, so it cannot be added to a session or be used "
-                "to determine ownership of content for other dependent "
-                "actions. This might be OK if only a small portion of "
-                "the actions were performed this way, but you may want "
-                "to check the percentage of fully anonymous actions "
-                "after the crawl has completed to determine whether that "
-                "percentage of data loss is acceptable to you. To prevent "
-                "this in the future, you can disable fully anonymous "
-                "(anonymous to instructors) posting in your Piazza course "
-                "in the \"Manage Course\" tab on their website."))
+            crawl_id=crawl.id, message=CrawlError.FULLY_ANON_MESSAGE)
         crawl.errors.append(error)
         db.session.add(error)
         return error
@@ -452,16 +833,283 @@ class ActionType(IntEnum):
                                        anonymous)
 
 
+def _history_action_types(post_type):
+    #
+    # ActionType.from_post_history looks at four facts about a history
+    # item, so every possible answer is tabulated up front by feeding it
+    # stand-in posts that realize each combination. The table is indexed
+    # by is_edit << 3 | my_post << 2 | my_parent << 1 | anon.
+    #
+    table = []
+    for bits in range(16):
+        is_edit, my_post, my_parent, anon = (bool(bits & 8), bool(bits & 4),
+                                             bool(bits & 2), bool(bits & 1))
+        item = {'uid': 'me', 'anon': 'stud' if anon else 'no'}
+        post = {
+            'type': post_type,
+            'history': [{
+                'uid': 'me' if my_post else 'other'
+            }]
+        }
+        parent = {'history': [{'uid': 'me' if my_parent else 'other'}]}
+        table.append(
+            int(
+                ActionType.from_post_history(
+                    parent, post, item, is_edit=is_edit)))
+    return table
+
+
+def _followup_action_types():
+    # indexed by my_parent << 1 | anon
+    table = []
+    for bits in range(4):
+        post = {'uid': 'me', 'anon': 'stud' if bits & 1 else 'no'}
+        parent = {'history': [{'uid': 'me' if bits & 2 else 'other'}]}
+        table.append(int(ActionType.followup_action_type(parent, post)))
+    return table
+
+
+def _feedback_action_types():
+    # indexed by my_parent << 2 | my_root << 1 | anon
+    table = []
+    for bits in range(8):
+        post = {'uid': 'me', 'anon': 'stud' if bits & 1 else 'no'}
+        parent = {'uid': 'me' if bits & 4 else 'other'}
+        root = {'history': [{'uid': 'me' if bits & 2 else 'other'}]}
+        table.append(int(ActionType.feedback_action_type(root, parent, post)))
+    return table
+
+
+HISTORY_ACTION_TYPES = {
+    post_type: _history_action_types(post_type)
+    for post_type in ['note', 'poll', 'question', 'i_answer', 's_answer']
+}
+FOLLOWUP_ACTION_TYPES = _followup_action_types()
+FEEDBACK_ACTION_TYPES = _feedback_action_types()
+
+
+def parse_timestamp(value):
+    """
+    Parses a Piazza timestamp like 2018-09-04T17:21:05Z, which is
+    considerably faster than datetime.strptime for the fixed format Piazza
+    uses. Anything else is left to strptime.
+    """
+    if len(value) == 20 and value[10] == 'T' and value[19] == 'Z':
+        try:
+            if _fromisoformat:
+                return _fromisoformat(value[:19])
+            return datetime(
+                int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                int(value[11:13]), int(value[14:16]), int(value[17:19]))
+        except ValueError:
+            pass
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+
+
+# datetime.fromisoformat is only available from Python 3.7
+_fromisoformat = getattr(datetime, 'fromisoformat', None)
+
+
+class ActionColumns(object):
+    """
+    The actions found in one or more posts, stored as parallel lists (one
+    entry per action in each) rather than as a list of objects.
+    `num_fully_anon` counts the contributions that were skipped because
+    they were posted anonymously to instructors and so have no uid.
+    """
+
+    def __init__(self):
+        self.post_id = []
+        self.uid = []
+        self.type_id = []
+        self.time = []
+        self.content = []
+        self.num_fully_anon = 0
+
+    def __len__(self):
+        return len(self.type_id)
+
+    def extend(self, other):
+        self.post_id.extend(other.post_id)
+        self.uid.extend(other.uid)
+        self.type_id.extend(other.type_id)
+        self.time.extend(other.time)
+        self.content.extend(other.content)
+        self.num_fully_anon += other.num_fully_anon
+
+    def select(self, indices):
+        """Returns a copy holding only the actions at `indices`."""
+        selected = ActionColumns()
+        for name in ['post_id', 'uid', 'type_id', 'time', 'content']:
+            column = getattr(self, name)
+            setattr(selected, name, [column[i] for i in indices])
+        selected.num_fully_anon = self.num_fully_anon
+        return selected
+
+    def rows(self, **fields):
+        return [
+            dict(fields, post_id=post_id, type_id=type_id, time=time)
+            for post_id, type_id, time in zip(self.post_id, self.type_id,
+                                              self.time)
+        ]
+
+
+def classify_post(post, actions=None, with_content=True):
+    """
+    Finds all of the actions in a post in a single walk over it, appending
+    them to `actions` (a new ActionColumns if not given) and returning it.
+    Without `with_content`, the content of every action is None.
+    The resulting action types are the same as the ones given by the
+    ActionType classmethods, but are looked up in tables precomputed from
+    them.
+    """
+    #
+    # there are two layers:
+    # root['children'] == ir, sr, followups
+    # followup['children] == feedback
+    #
+    if actions is None:
+        actions = ActionColumns()
+
+    post_id = post['id']
+    post_ids = actions.post_id
+    uids = actions.uid
+    type_ids = actions.type_id
+    times = actions.time
+    contents = actions.content
+
+    root_uid = post['history'][-1].get('uid')
+
+    def add_history(child):
+        try:
+            table = HISTORY_ACTION_TYPES[child['type']]
+        except KeyError:
+            table = None
+        author_uid = child['history'][-1].get('uid')
+
+        #
+        # history is in reverse-chronological order
+        #
+        is_edit = 0
+        for item in reversed(child['history']):
+            uid = item.get('uid')
+            if uid is None or root_uid is None or author_uid is None:
+                actions.num_fully_anon += 1
+                is_edit = 8
+                continue
+            if table is None:
+                raise Exception('invalid post type')
+
+            anon = 'anon' in item and item['anon'] != 'no'
+            type_ids.append(table[is_edit | (author_uid == uid) << 2 |
+                                  (root_uid == uid) << 1 | anon])
+            times.append(parse_timestamp(item['created']))
+            if not with_content:
+                contents.append(None)
+            elif item['subject']:
+                contents.append("\n".join([item['subject'], item['content']]))
+            else:
+                contents.append(item['content'])
+            uids.append(uid)
+            post_ids.append(post_id)
+            is_edit = 8
+
+    def add_followup(followup):
+        uid = followup.get('uid')
+        if uid is None or root_uid is None:
+            actions.num_fully_anon += 1
+        else:
+            anon = 'anon' in followup and followup['anon'] != 'no'
+            type_ids.append(FOLLOWUP_ACTION_TYPES[(root_uid == uid) << 1
+                                                  | anon])
+            times.append(parse_timestamp(followup['created']))
+            contents.append(followup['subject'] if with_content else None)
+            uids.append(uid)
+            post_ids.append(post_id)
+
+        for feedback in followup['children']:
+            uid = feedback.get('uid')
+            if uid is None or followup.get('uid') is None or root_uid is None:
+                actions.num_fully_anon += 1
+                continue
+
+            anon = 'anon' in feedback and feedback['anon'] != 'no'
+            type_ids.append(FEEDBACK_ACTION_TYPES[
+                (followup['uid'] == uid) << 2 | (root_uid == uid) << 1 | anon])
+            # feedback has always been given the time of the followup it
+            # belongs to
+            times.append(parse_timestamp(followup['created']))
+            contents.append(feedback['subject'] if with_content else None)
+            uids.append(uid)
+            post_ids.append(post_id)
+
+    add_history(post)
+    for child in post['children']:
+        if child['type'] == 'i_answer' or child['type'] == 's_answer':
+            add_history(child)
+        else:
+            add_followup(child)
+
+    return actions
+
+
+def strip_post_content(post):
+    """
+    Returns a copy of a post with the subject and text of everything in it
+    blanked out, keeping only what classify_post needs to find its actions
+    (without their content).
+    """
+
+    def strip_history(child):
+        return dict(
+            child,
+            history=[
+                dict(item, subject='', content='')
+                for item in child['history']
+            ])
+
+    def strip_followup(followup):
+        return dict(
+            followup,
+            subject='',
+            children=[
+                dict(feedback, subject='')
+                for feedback in followup['children']
+            ])
+
+    stripped = strip_history(post)
+    stripped['children'] = [
+        strip_history(child)
+        if child['type'] == 'i_answer' or child['type'] == 's_answer' else
+        strip_followup(child) for child in post['children']
+    ]
+    return stripped
+
+
 class Action(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     crawl_id = db.Column(db.Integer, db.ForeignKey('crawl.id'), nullable=False)
     crawl = db.relationship(
         'Crawl',
         backref=db.backref('actions', lazy=True, cascade='all, delete-orphan'))
-    uid = db.Column(db.String(120), nullable=False, index=True)
+    post_id = db.Column(db.String(20), index=True)
+    user_id = db.Column(
+        db.Integer, db.ForeignKey('crawl_user.id'), nullable=False, index=True)
+    user = db.relationship('CrawlUser')
     type_id = db.Column(db.Integer, nullable=False)
     time = db.Column(db.DateTime, nullable=False)
-    content = db.deferred(db.Column(db.Text))
+    content_digest = db.Column(
+        db.String(40),
+        db.ForeignKey('action_content.digest'),
+        nullable=True,
+        index=True)
+    stored_content = db.relationship('ActionContent')
+
+    @property
+    def content(self):
+        if self.stored_content is None:
+            return None
+        return self.stored_content.text()
 
     def action_type(self):
         return ActionType(self.type_id)
@@ -477,10 +1125,30 @@ class Analysis(db.Model):
     session_gap = db.Column(db.Float, nullable=False)
     role_count = db.Column(db.Integer, nullable=False)
     max_iterations = db.Column(db.Integer, nullable=False)
+    # the number of iterations every chain runs before it may stop early
+    # on convergence; analyses without one always ran max_iterations
+    min_iterations = db.Column(db.Integer, nullable=True)
+    # the iteration at which sampling stopped, which is the last iteration
+    # of the longest-running chain
+    stop_iteration = db.Column(db.Integer, nullable=True)
     proportion_smoothing = db.Column(db.Float, nullable=False)
     role_smoothing = db.Column(db.Float, nullable=False)
+    # the number of independent sampling chains to run; the roles are
+    # taken from the chain that ends with the highest log joint likelihood
+    num_chains = db.Column(db.Integer, nullable=False, server_default="1")
+    # the final log joint likelihood of each chain, in chain order
+    chain_log_likelihoods = db.Column(db.JSON, nullable=True)
     finished = db.Column(db.Boolean, default=False)
     task_id = db.Column(db.String(120), index=True)
+    session_set_id = db.Column(
+        db.Integer, db.ForeignKey('session_set.id'), nullable=True)
+    session_set = db.relationship('SessionSet')
+
+    @property
+    def sessions(self):
+        if self.session_set is None:
+            return []
+        return self.session_set.sessions
 
     def progress(self):
         keys = ['sessions', 'training_data', 'sampling', 'saving']
@@ -494,96 +1162,39 @@ class Analysis(db.Model):
             pass
         return {key: 0 for key in keys}
 
-    def session_length_stats(self):
-        session_lens = Action.query.join(Action, Session.actions)\
-                .filter(Session.analysis_id == self.id)\
-                .with_entities(Session.id,
-                               func.count(Action.id).label('length'))\
-                .group_by(Session.id)\
-                .subquery()
-
-        return db.session.query(
-            func.avg(session_lens.c.length).label('avg'),
-            func.stddev_pop(session_lens.c.length).label('std')).first()
-
     def extract_sessions(self, progress_report):
-        actions = Action.query.filter_by(crawl_id=self.crawl_id)
-        total = actions.count()
-        current = 0
-
-        def add_and_report(session, force=False):
-            result = current
-            if session:
-                db.session.add(session)
-                result += len(session.actions)
-                progress_report(result, total)
-            return result
-
-        actions = actions.order_by(Action.uid).order_by(Action.time)
-        gap_len = timedelta(hours=self.session_gap)
-
-        uid = None
-        session = None
-        prev_action = None
-        for action in actions:
-            # A session "ends" if either the current user is different (we've
-            # moved to a different user's action list) or if the gap length
-            # between the previous action and this action is more than the
-            # analysis' session_gap
-            if action.uid != uid or (prev_action and
-                                     action.time - prev_action.time > gap_len):
-                current = add_and_report(session)
-                session = Session(uid=action.uid, analysis_id=self.id)
-                uid = action.uid
-                prev_action = None
-
-            session.actions.append(action)
-            prev_action = action
-
-        current = add_and_report(session)
-        db.session.commit()
-
-        # Get ordered sessions by time for each user
-        sessions = Action.query.join(Action, Session.actions)\
-                .filter(Session.analysis_id == self.id)\
-                .with_entities(func.min(Action.time).label('start_time'),
-                               Session.id, Session.uid)\
-                .group_by(Session.id)\
-                .order_by(Session.uid)\
-                .order_by('start_time').all()
+        """
+        Splits the crawl's actions into sessions, reusing the sessions of
+        an earlier analysis of the same actions with the same session gap
+        when there is one.
+        """
+        snapshot = self.crawl.snapshot()
+        sessions = snapshot.sessions(self.session_gap)
+        progress_report(0, len(sessions))
+
+        if self.session_set is None:
+            self.session_set = SessionSet.acquire(self.crawl,
+                                                  self.session_gap)
+        session_set = self.session_set
+
+        if session_set.extracted:
+            ids = db.session.query(Session.id)\
+                    .filter(Session.session_set_id == session_set.id)\
+                    .order_by(Session.id)
+            sessions.ids = np.array([row[0] for row in ids], dtype=np.int64)
+        else:
+            session_set.store(sessions, progress_report)
 
+        db.session.commit()
+        progress_report(len(sessions), len(sessions))
         return sessions
 
     def create_training_data(self, sessions, progress_report):
-        training_data = []
-        user_sessions = []
-        current_user = None
-        total_sessions = len(sessions)
-        for idx, session in enumerate(sessions):
-            progress_report(idx, total_sessions)
-
-            if current_user != session.uid:
-                if user_sessions:
-                    training_data.append(user_sessions)
-                    user_sessions = []
-                current_user = session.uid
-
-            # Extracts a list of tuples (type_id, count(type_id))
-            histogram = Action.query.join(Action, Session.actions)\
-                    .filter(Session.id == session.id)\
-                    .with_entities(Action.type_id,
-                                   func.count(Action.type_id))\
-                    .group_by(Action.type_id)\
-                    .order_by(Action.type_id)
-
-            # Python IDs start at 1; C++ expects starting at 0, so shift
-            # all IDs down by one
-            mod_hist = [(type_id - 1, count) for (type_id, count) in histogram]
-            user_sessions.append(mdmm_sampler.Session(mod_hist))
-
-        if user_sessions:
-            training_data.append(user_sessions)
-
+        progress_report(0, len(sessions))
+        # Python IDs start at 1; C++ expects starting at 0, which is how
+        # the histograms' columns are already numbered
+        training_data = sessions.training_data(len(ActionType))
+        progress_report(len(sessions), len(sessions))
         return training_data
 
     def run_sampler(self, training_data, progress_report):
@@ -591,17 +1202,52 @@ class Analysis(db.Model):
             num_topics=self.role_count,
             num_actions=len(ActionType),
             alpha=self.proportion_smoothing,
-            beta=self.role_smoothing)
-
+            beta=self.role_smoothing,
+            # most sessions are a single action of one of a few types, so
+            # many of each user's sessions are identical and can be
+            # sampled as a group
+            collapse_sessions=True,
+            # the cost of the lgamma kernel depends on the number of
+            # distinct actions in a session rather than on its length, which
+            # matters for the long sessions of the most active users
+            kernel=mdmm_sampler.MDMM.LikelihoodKernel.lgamma,
+            # there are only a few dozen action types, so the counts fit in
+            # a small dense matrix that can be scored against all of the
+            # roles at once
+            backend=mdmm_sampler.MDMM.Backend.dense)
+
+        if self.min_iterations is None:
+            stopping = mdmm_sampler.StoppingRule()
+        else:
+            stopping = mdmm_sampler.StoppingRule(
+                burn_in=self.min_iterations,
+                window=CONVERGENCE_WINDOW,
+                tolerance=CONVERGENCE_TOLERANCE)
+
+        # the training data is passed as flat arrays that the sampler reads
+        # in place; each chain runs on its own thread with its own stream
+        # of random numbers jumped ahead from the same seed
         rng = mdmm_sampler.random.Xoroshiro128(47)
-        sampler = mdmm_sampler.MDMM(training_data, options, rng)
-
-        sampler.run(training_data, self.max_iterations, rng, progress_report)
-
-        return sampler
+        chains = mdmm_sampler.run_chains(
+            *training_data,
+            options=options,
+            num_chains=self.num_chains,
+            num_iters=self.max_iterations,
+            rng=rng,
+            progress=progress_report,
+            stopping=stopping)
+
+        self.stop_iteration = max(chain.num_iterations() for chain in chains)
+        self.chain_log_likelihoods = [
+            chain.log_joint_likelihood() for chain in chains
+        ]
+        best = max(
+            range(len(chains)), key=lambda c: self.chain_log_likelihoods[c])
+        return chains[best]
 
     def save_sampler_output(self, sessions, sampler, progress_report):
-        total_iters = self.role_count - 1 + len(sessions) - 1
+        user_ids = sessions.snapshot.user_ids
+        total_iters = self.role_count + len(user_ids)
         # Create the roles
         roles = []
         for role_num in range(0, self.role_count):
@@ -615,53 +1261,298 @@ class Analysis(db.Model):
                 weight = ActionWeight(
                     role=role, type_id=int(action_type), weight=prob)
                 db.session.add(weight)
+        db.session.flush()
 
-        def create_role_proportions(user_number, uid):
+        # Create the user role proportions; users are numbered in the order
+        # they appear in the snapshot, which is the order of the training
+        # data
+        for user_num, user_id in enumerate(user_ids):
+            progress_report(self.role_count + user_num, total_iters)
             for role_id, role in enumerate(roles):
-                prob = sampler.role_probability(user_number, role_id)
+                prob = sampler.role_probability(user_num, role_id)
                 proportion = RoleProportion(
-                    uid=uid, analysis=self, role=role, weight=prob)
+                    user_id=user_id, analysis=self, role=role, weight=prob)
                 db.session.add(proportion)
 
-        # Create the session role assignments and user role proportions
-        user_id = -1
-        current_user = None
-        for idx, sess in enumerate(sessions):
-            progress_report(self.role_count + idx, total_iters)
-            if current_user != sess.uid:
-                user_id += 1
-                current_user = sess.uid
-                create_role_proportions(user_id, current_user)
-
-            session = Session.query.get(sess.id)
-            session.role = roles[sampler.topic_assignment(idx)]
+        # Create the session role assignments
+        role_ids = [
+            roles[sampler.topic_assignment(idx)].id
+            for idx in range(len(sessions))
+        ]
+        for i in range(0, len(sessions), BULK_INSERT_SIZE):
+            db.session.execute(
+                db.text("""
+                INSERT INTO session_role (session_id, role_id)
+                SELECT unnest(:ids), unnest(:role_ids)
+                """), {
+                    'ids': sessions.ids[i:i + BULK_INSERT_SIZE].tolist(),
+                    'role_ids': role_ids[i:i + BULK_INSERT_SIZE]
+                })
+
+        self.summary = AnalysisSummary.compute(
+            sessions, collections.Counter(role_ids))
         db.session.commit()
+        progress_report(total_iters, total_iters)
+
+    def get_summary(self):
+        """
+        Returns the summary of this analysis, which is stored along with
+        its roles when it finishes (and was backfilled for analyses that
+        finished before summaries were kept), or None if it hasn't
+        finished.
+        """
+        return self.summary
+
+
+class SessionSet(db.Model):
+    """
+    The sessions of a crawl's actions for one session gap. Every analysis
+    of the same actions with the same session gap shares one set, which is
+    deleted once no analysis refers to it any more.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    crawl_id = db.Column(
+        db.Integer,
+        db.ForeignKey('crawl.id', ondelete='CASCADE'),
+        nullable=False)
+    crawl = db.relationship(
+        'Crawl',
+        backref=db.backref('session_sets', lazy=True, passive_deletes=True))
+    # the Crawl.snapshot_version() of the actions the sessions were taken
+    # from
+    snapshot_version = db.Column(db.String(120), nullable=False)
+    session_gap = db.Column(db.Float, nullable=False)
+    # the highest id of those actions: actions added by later recrawls have
+    # higher ids, so they can be kept out of the sessions
+    max_action_id = db.Column(db.Integer)
+    # the number of analyses using this set
+    ref_count = db.Column(db.Integer, nullable=False, server_default="0")
+    extracted = db.Column(
+        db.Boolean, nullable=False, server_default=db.false())
+    sessions = db.relationship(
+        'Session', backref='session_set', lazy=True, passive_deletes=True)
+
+    __table_args__ = (db.UniqueConstraint('crawl_id', 'snapshot_version',
+                                          'session_gap'), )
 
+    @staticmethod
+    def acquire(crawl, session_gap):
+        """
+        Returns the session set for the current actions of `crawl` and
+        `session_gap`, creating it if needed, and counts one more analysis
+        as using it.
+
+        The set's row stays locked until the transaction ends, so an
+        analysis that finds a set some other analysis is still extracting
+        waits for it to finish rather than seeing it half written.
+        """
+        stmt = insert(SessionSet.__table__).values(
+            crawl_id=crawl.id,
+            snapshot_version=crawl.snapshot_version(),
+            session_gap=session_gap,
+            ref_count=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['crawl_id', 'snapshot_version', 'session_gap'],
+            set_={'ref_count': SessionSet.ref_count + 1})\
+                .returning(SessionSet.id)
+        session_set_id = db.session.execute(stmt).scalar()
+        return SessionSet.query.populate_existing().get(session_set_id)
 
-session_action = db.Table(
-    'session_action',
+    @staticmethod
+    def release(connection, session_set_id):
+        """
+        Counts one fewer analysis as using a session set, deleting the set
+        (and its sessions) once nothing uses it.
+        """
+        table = SessionSet.__table__
+        connection.execute(table.update()
+                           .where(table.c.id == session_set_id)
+                           .values(ref_count=table.c.ref_count - 1))
+        connection.execute(table.delete()
+                           .where(table.c.id == session_set_id)
+                           .where(table.c.ref_count <= 0))
+
+    def store(self, sessions, progress_report):
+        """Writes the sessions of a Segmentation to this set."""
+        snapshot = sessions.snapshot
+
+        # the ids are drawn from the session table's sequence up front so
+        # the sessions can be inserted in bulk and still be referred to
+        # when their roles are assigned
+        ids = db.session.execute(
+            db.text("""
+            SELECT nextval(pg_get_serial_sequence('session', 'id'))
+            FROM generate_series(1, :count)
+            """), {'count': len(sessions)})
+        sessions.ids = np.array(sorted(row[0] for row in ids), dtype=np.int64)
+
+        if len(snapshot):
+            self.max_action_id = int(snapshot.action_id.max())
+        user_ids = np.asarray(snapshot.user_ids)[sessions.users]
+        start_times = snapshot.time[sessions.starts]
+        end_times = snapshot.time[sessions.ends - 1]
+        for i in range(0, len(sessions), BULK_INSERT_SIZE):
+            chunk = slice(i, i + BULK_INSERT_SIZE)
+            db.session.execute(
+                db.text("""
+                INSERT INTO session
+                    (id, user_id, session_set_id, start_time, end_time)
+                SELECT unnest(:ids), unnest(:user_ids), :session_set_id,
+                       to_timestamp(unnest(:start_times)) AT TIME ZONE 'UTC',
+                       to_timestamp(unnest(:end_times)) AT TIME ZONE 'UTC'
+                """), {
+                    'ids': sessions.ids[chunk].tolist(),
+                    'user_ids': user_ids[chunk].tolist(),
+                    'session_set_id': self.id,
+                    'start_times': start_times[chunk].tolist(),
+                    'end_times': end_times[chunk].tolist()
+                })
+            progress_report(
+                min(i + BULK_INSERT_SIZE, len(sessions)), len(sessions))
+        self.extracted = True
+
+
+@event.listens_for(Analysis, 'after_delete')
+def release_session_set(mapper, connection, analysis):
+    if analysis.session_set_id is not None:
+        SessionSet.release(connection, analysis.session_set_id)
+
+
+session_role = db.Table(
+    'session_role',
     db.Column(
         'session_id',
         db.Integer,
-        db.ForeignKey('session.id'),
+        db.ForeignKey('session.id', ondelete='CASCADE'),
         primary_key=True),
     db.Column(
-        'action_id', db.Integer, db.ForeignKey('action.id'), primary_key=True))
+        'role_id',
+        db.Integer,
+        db.ForeignKey('role.id', ondelete='CASCADE'),
+        primary_key=True,
+        index=True))
 
 
 class Session(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    uid = db.Column(db.String(120), nullable=False, index=True)
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('crawl_user.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True)
+    user = db.relationship('CrawlUser', lazy='joined')
+    session_set_id = db.Column(
+        db.Integer,
+        db.ForeignKey('session_set.id', ondelete='CASCADE'),
+        nullable=False,
+        index=True)
+    # a session is a run of consecutive actions by one user, so it is
+    # stored as the time span of those actions rather than as a list; the
+    # actions recrawls added since are told apart by the session set's
+    # max_action_id
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+
+    @cached_property
+    def actions(self):
+        return Action.query.filter(
+            Action.crawl_id == self.session_set.crawl_id,
+            Action.id <= self.session_set.max_action_id,
+            Action.user_id == self.user_id,
+            Action.time.between(self.start_time, self.end_time)).order_by(
+                Action.time, Action.id).all()
+
+    @staticmethod
+    def load_actions(sessions):
+        """
+        Loads the actions of all of the given sessions, which must belong to
+        the same session set, with a single query rather than one per session.
+        Only the actions of their users between the start of the earliest
+        session and the end of the latest one are loaded.
+        """
+        if not sessions:
+            return
+        session_set = sessions[0].session_set
+        user_ids = {session.user_id for session in sessions}
+        start_time = min(session.start_time for session in sessions)
+        end_time = max(session.end_time for session in sessions)
+        by_user = {user_id: [] for user_id in user_ids}
+        actions = Action.query.filter(Action.crawl_id == session_set.crawl_id)\
+                .filter(Action.id <= session_set.max_action_id)\
+                .filter(Action.user_id.in_(user_ids))\
+                .filter(Action.time.between(start_time, end_time))\
+                .order_by(Action.time, Action.id)
+        for action in actions:
+            by_user[action.user_id].append(action)
+
+        for session in sessions:
+            session.__dict__['actions'] = [
+                action for action in by_user[session.user_id]
+                if session.start_time <= action.time <= session.end_time
+            ]
+
+
+class AnalysisSummary(db.Model):
+    """
+    Statistics about an analysis's actions and sessions, computed once when
+    the analysis finishes so that viewing it doesn't have to count them.
+    """
     analysis_id = db.Column(
-        db.Integer, db.ForeignKey('analysis.id'), nullable=False)
+        db.Integer, db.ForeignKey('analysis.id'), primary_key=True)
     analysis = db.relationship(
         'Analysis',
         backref=db.backref(
-            'sessions', lazy=True, cascade='all, delete-orphan'))
-    role_id = db.Column(
-        db.Integer, db.ForeignKey('role.id'), nullable=True, default=None)
-    role = db.relationship('Role', backref=db.backref('sessions', lazy=True))
-    actions = db.relationship('Action', secondary=session_action, lazy=False)
+            'summary', uselist=False, cascade='all, delete-orphan'))
+    num_actions = db.Column(db.Integer, nullable=False)
+    num_sessions = db.Column(db.Integer, nullable=False)
+    num_users = db.Column(db.Integer, nullable=False)
+    # session lengths, in actions; these are null when there are no
+    # sessions
+    length_avg = db.Column(db.Float)
+    length_std = db.Column(db.Float)
+    length_median = db.Column(db.Float)
+    length_p90 = db.Column(db.Float)
+    length_max = db.Column(db.Integer)
+    # length_histogram[i] is the number of sessions of length i + 1
+    length_histogram = db.Column(db.JSON, nullable=False)
+    # {type_id: number of actions of that type}
+    action_type_counts = db.Column(db.JSON, nullable=False)
+    # {role id: number of sessions assigned to that role}
+    role_session_counts = db.Column(db.JSON, nullable=False)
+
+    @staticmethod
+    def compute(sessions, role_session_counts):
+        snapshot = sessions.snapshot
+        lengths = sessions.lengths
+        type_counts = np.bincount(snapshot.type_id)
+
+        summary = AnalysisSummary(
+            num_actions=len(snapshot),
+            num_sessions=len(sessions),
+            num_users=len(snapshot.user_ids),
+            length_histogram=np.bincount(lengths)[1:].tolist(),
+            action_type_counts={
+                str(type_id): int(count)
+                for type_id, count in enumerate(type_counts) if count
+            },
+            role_session_counts={
+                str(role_id): int(count)
+                for role_id, count in role_session_counts.items()
+            })
+        if len(lengths):
+            summary.length_avg = float(lengths.mean())
+            summary.length_std = float(lengths.std())
+            summary.length_median = float(np.median(lengths))
+            summary.length_p90 = float(np.percentile(lengths, 90))
+            summary.length_max = int(lengths.max())
+        return summary
+
+    def role_share(self, role):
+        """The percentage of sessions assigned to `role`."""
+        if not self.num_sessions:
+            return 0.0
+        count = self.role_session_counts.get(str(role.id), 0)
+        return 100.0 * count / self.num_sessions
 
 
 class Role(db.Model):
@@ -671,6 +1562,8 @@ class Role(db.Model):
     analysis = db.relationship(
         'Analysis',
         backref=db.backref('roles', lazy=True, cascade='all, delete-orphan'))
+    sessions = db.relationship(
+        'Session', secondary=session_role, lazy=True, passive_deletes=True)
 
 
 class ActionWeight(db.Model):
@@ -684,7 +1577,9 @@ class ActionWeight(db.Model):
 
 
 class RoleProportion(db.Model):
-    uid = db.Column(db.String(120), primary_key=True)
+    user_id = db.Column(
+        db.Integer, db.ForeignKey('crawl_user.id'), primary_key=True)
+    user = db.relationship('CrawlUser')
     analysis_id = db.Column(
         db.Integer, db.ForeignKey('analysis.id'), primary_key=True)
     analysis = db.relationship(
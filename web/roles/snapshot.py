@@ -0,0 +1,261 @@
+"""
+Columnar, memory-mapped snapshots of a crawl's actions.
+
+A snapshot holds just what the analyses need from each action (which user
+performed it, when, and its type) as fixed-width numpy arrays sorted by
+user and time, so that sessions, histograms and statistics for any number
+of analyses can be computed without going back to the database.
+"""
+from collections import namedtuple
+import glob
+import itertools
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+SNAPSHOT_FORMAT = 2
+
+COLUMNS = [
+    ('user', np.int32),
+    ('time', np.int64),
+    ('type_id', np.uint8),
+    ('action_id', np.int64),
+]
+
+# training data for the sampler in compressed sparse row form: the sessions
+# of user i are user_offsets[i]:user_offsets[i + 1], and the entries of
+# session s are session_offsets[s]:session_offsets[s + 1] of action_ids and
+# counts
+TrainingData = namedtuple(
+    'TrainingData',
+    ['user_offsets', 'session_offsets', 'action_ids', 'counts'])
+
+GapSummary = namedtuple(
+    'GapSummary',
+    ['session_gap', 'sessions', 'avg', 'std', 'median', 'p90', 'max'])
+
+
+class ActionSnapshot(object):
+    """
+    The actions of a crawl as parallel arrays, ordered by (user, time):
+
+    - `user`: the index into `user_ids` of the user who performed the
+      action
+    - `time`: when the action happened, in seconds since the epoch
+    - `type_id`: the action's ActionType
+    - `action_id`: the id of the action's row in the database
+
+    `user_ids` lists the CrawlUser id of every user with at least one
+    action, in the order they appear in the arrays.
+    """
+
+    def __init__(self, path, user_ids, user, time, type_id, action_id):
+        self.path = path
+        self.user_ids = user_ids
+        self.user = user
+        self.time = time
+        self.type_id = type_id
+        self.action_id = action_id
+        self._gaps = None
+
+    def __len__(self):
+        return len(self.action_id)
+
+    @staticmethod
+    def load(path):
+        """
+        Memory-maps the snapshot stored at `path`, returning None if there
+        isn't a (complete) one there.
+        """
+        try:
+            with open(os.path.join(path, 'meta.json')) as meta_file:
+                meta = json.load(meta_file)
+        except (IOError, ValueError):
+            return None
+        if meta.get('format') != SNAPSHOT_FORMAT:
+            return None
+
+        # numpy can't memory-map an empty file
+        mmap_mode = 'r' if meta['count'] else None
+        columns = {
+            name: np.load(
+                os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+            for name, _ in COLUMNS
+        }
+        return ActionSnapshot(path, meta['user_ids'], **columns)
+
+    @staticmethod
+    def build(path, rows, chunk_size=100000):
+        """
+        Writes a snapshot of `rows`, which must be (user_id, epoch seconds,
+        type_id, action_id) tuples ordered by user_id and then time, to
+        `path` and returns it. The rows may be a stream; only `chunk_size`
+        of them are held as tuples at once.
+
+        The snapshot is written to a temporary directory that is then
+        renamed into place, so readers never see a partial snapshot. Older
+        snapshots of the same crawl (those that share `path` up to its
+        extension) are removed.
+        """
+        user_ids = []
+        chunks = {name: [] for name, _ in COLUMNS}
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            ids = np.fromiter((row[0] for row in chunk),
+                              dtype=np.int64,
+                              count=len(chunk))
+            # a new user starts wherever the id changes, including at the
+            # start of the chunk if it doesn't continue the last user
+            new_user = np.empty(len(chunk), dtype=bool)
+            new_user[0] = not user_ids or user_ids[-1] != ids[0]
+            new_user[1:] = ids[1:] != ids[:-1]
+            user = np.cumsum(new_user, dtype=np.int64) + (len(user_ids) - 1)
+            user_ids.extend(ids[new_user].tolist())
+            chunks['user'].append(user.astype(np.int32))
+
+            for i, (name, dtype) in enumerate(COLUMNS[1:], start=1):
+                chunks[name].append(
+                    np.fromiter((row[i] for row in chunk),
+                                dtype=dtype,
+                                count=len(chunk)))
+
+        columns = {
+            name: np.concatenate(chunks[name]) if chunks[name] else np.empty(
+                0, dtype=dtype)
+            for name, dtype in COLUMNS
+        }
+        count = len(columns['action_id'])
+
+        parent = os.path.dirname(path)
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=parent, prefix='.building-')
+        for name, _ in COLUMNS:
+            np.save(os.path.join(tmp_path, name + '.npy'), columns[name])
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as meta_file:
+            json.dump({
+                'format': SNAPSHOT_FORMAT,
+                'count': count,
+                'user_ids': user_ids
+            }, meta_file)
+
+        stale = glob.glob(os.path.splitext(path)[0] + '.*')
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # someone else built the same snapshot first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        for stale_path in stale:
+            if stale_path != path:
+                shutil.rmtree(stale_path, ignore_errors=True)
+
+        return ActionSnapshot.load(path)
+
+    def gaps(self):
+        """
+        The number of seconds between each action and the previous action
+        by the same user, or infinity for a user's first action.
+        """
+        if self._gaps is None:
+            gaps = np.empty(len(self), dtype=np.float64)
+            gaps[:1] = np.inf
+            gaps[1:] = np.diff(self.time)
+            gaps[1:][self.user[1:] != self.user[:-1]] = np.inf
+            self._gaps = gaps
+        return self._gaps
+
+    def session_starts(self, session_gap):
+        """
+        Splits the actions into sessions, returning the index of the first
+        action of each one. A new session starts whenever the user changes
+        or more than `session_gap` hours have passed since the user's
+        previous action.
+        """
+        return np.flatnonzero(self.gaps() > session_gap * 3600)
+
+    def sessions(self, session_gap):
+        return Segmentation(self, self.session_starts(session_gap))
+
+    def sweep(self, session_gaps):
+        """
+        Summarizes the sessions that each of the given session gaps would
+        produce. The gaps between actions are only computed once, and each
+        segmentation is then a single comparison against them.
+        """
+        summaries = []
+        for session_gap in sorted(set(session_gaps)):
+            lengths = self.sessions(session_gap).lengths
+            if len(lengths) == 0:
+                summaries.append(
+                    GapSummary(session_gap, 0, None, None, None, None, None))
+                continue
+            summaries.append(
+                GapSummary(session_gap, len(lengths), float(lengths.mean()),
+                           float(lengths.std()), float(np.median(lengths)),
+                           float(np.percentile(lengths, 90)),
+                           int(lengths.max())))
+        return summaries
+
+
+class Segmentation(object):
+    """
+    A division of a snapshot's actions into sessions, each of which is a
+    run of consecutive actions starting at one of `starts`.
+    """
+
+    def __init__(self, snapshot, starts):
+        self.snapshot = snapshot
+        self.starts = starts
+        self.ends = np.append(starts[1:], len(snapshot)).astype(np.int64)
+        # the ids of the Session rows for these sessions, once stored
+        self.ids = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def users(self):
+        return self.snapshot.user[self.starts]
+
+    @property
+    def lengths(self):
+        return self.ends - self.starts
+
+    def session_index(self):
+        """The session each action belongs to."""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+    def histograms(self, num_types):
+        """
+        Counts the actions of each type in each session, returning only the
+        nonzero counts as parallel (session, column, count) arrays ordered
+        by session and then column, where column i counts type_id i + 1.
+
+        Sessions only use a few of the action types, so this is much
+        smaller than the full (sessions x num_types) matrix.
+        """
+        cells = (self.session_index() * num_types +
+                 self.snapshot.type_id.astype(np.int64) - 1)
+        cells, counts = np.unique(cells, return_counts=True)
+        return cells // num_types, cells % num_types, counts
+
+    def training_data(self, num_types):
+        """
+        The histograms of the sessions, grouped by user, as TrainingData.
+        Every user in the snapshot has at least one session.
+        """
+        session_ids, type_ids, counts = self.histograms(num_types)
+        user_offsets = np.searchsorted(
+            self.users, np.arange(len(self.snapshot.user_ids) + 1))
+        session_offsets = np.searchsorted(session_ids,
+                                          np.arange(len(self) + 1))
+        return TrainingData(
+            user_offsets.astype(np.uint64),
+            session_offsets.astype(np.uint64),
+            type_ids.astype(np.uint64), counts.astype(np.uint64))
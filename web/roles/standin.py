@@ -0,0 +1,520 @@
+"""
+A local stand-in for the parts of Piazza's API that the crawler uses, so
+that crawls can be exercised and benchmarked without live credentials or
+network access.
+
+The server replays a course dump, which is either recorded (see
+`record_course`) or generated (see `Course.synthetic`), and can inject
+latency, errors and Piazza-style rate limiting into its responses.
+
+    # serve a synthetic 3000 post course on port 8001
+    python -m roles.standin serve --synthetic 3000 --port 8001
+
+    # serve a recorded course with 200ms of latency and 1% errors
+    python -m roles.standin serve --dump course.json --latency 0.2 \\
+        --error-rate 0.01
+
+    # measure fetch throughput against an in-process stand-in
+    python -m roles.standin bench --synthetic 3000 --latency 0.1 \\
+        --max-rate 20 --rate 20 --concurrency 8
+
+Setting PIAZZA_URL=http://localhost:8001 makes the web app and the crawl
+tasks talk to a running stand-in instead of Piazza. Any email and
+password can be used to log in.
+"""
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+import argparse
+import collections
+import json
+import random
+import threading
+import time
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+STANDIN_UID = 'standin_instructor'
+
+
+class Course(object):
+    def __init__(self, network, posts):
+        self.network = network
+        self.posts = {post['id']: post for post in posts}
+
+        # the feed lists the most recently modified posts first
+        self.feed = sorted(
+            (feed_item(post) for post in posts),
+            key=lambda item: item['modified'],
+            reverse=True)
+
+    @staticmethod
+    def from_dump(path):
+        with open(path) as dump:
+            data = json.load(dump)
+        return Course(data['network'], data['posts'])
+
+    def save(self, path):
+        with open(path, 'w') as dump:
+            json.dump({
+                'network': self.network,
+                'posts': list(self.posts.values())
+            }, dump)
+
+    @staticmethod
+    def synthetic(num_posts, num_users=None, seed=0):
+        """
+        Generates a course with the same shape as a real one: questions,
+        notes and polls with edit histories, student and instructor
+        answers, followups and feedback, with a mix of named, anonymous
+        and fully anonymous (no uid) contributions.
+        """
+        rng = random.Random(seed)
+        num_users = num_users or max(10, num_posts // 5)
+        users = ['user{:05d}'.format(i) for i in range(num_users)]
+        instructors = users[:max(1, num_users // 50)]
+        start = datetime(2018, 8, 27)
+
+        def timestamp(minutes):
+            return (start + timedelta(minutes=minutes)).strftime(TIME_FORMAT)
+
+        def contribution(uid, minutes, **fields):
+            item = dict(fields)
+            item['created'] = timestamp(minutes)
+            item['anon'] = rng.choice(['no', 'no', 'no', 'stud'])
+            if rng.random() < 0.01:
+                # fully anonymous (anonymous to instructors) posts have no uid
+                item['anon'] = 'full'
+            else:
+                item['uid'] = uid
+            return item
+
+        def history(author, minutes, max_edits, editors=users):
+            entries = [
+                contribution(
+                    author,
+                    minutes,
+                    subject='Subject',
+                    content='<p>Content</p>')
+            ]
+            for _ in range(rng.randrange(max_edits + 1)):
+                minutes += rng.randrange(1, 120)
+                entries.append(
+                    contribution(
+                        rng.choice([author, rng.choice(editors)]),
+                        minutes,
+                        subject='Subject',
+                        content='<p>Edited content</p>'))
+            # Piazza lists history in reverse-chronological order
+            return list(reversed(entries)), minutes
+
+        posts = []
+        for nr in range(1, num_posts + 1):
+            post_type = rng.choice(['question'] * 6 + ['note'] * 3 + ['poll'])
+            minutes = int(nr * 16 * 7 * 24 * 60 / num_posts)
+            post_history, latest = history(rng.choice(users), minutes, 2)
+            post = {
+                'id': 'standin{:08d}'.format(nr),
+                'nr': nr,
+                'type': post_type,
+                'history': post_history,
+                'children': []
+            }
+
+            if post_type == 'question':
+                if rng.random() < 0.6:
+                    answer_history, end = history(
+                        rng.choice(users), minutes + rng.randrange(1, 600),
+                        2)
+                    post['children'].append({
+                        'type': 's_answer',
+                        'history': answer_history,
+                        'children': []
+                    })
+                    latest = max(latest, end)
+                if rng.random() < 0.5:
+                    answer_history, end = history(
+                        rng.choice(instructors),
+                        minutes + rng.randrange(1, 600), 1, instructors)
+                    answer_history = [
+                        dict(item, uid=rng.choice(instructors), anon='no')
+                        for item in answer_history
+                    ]
+                    post['children'].append({
+                        'type': 'i_answer',
+                        'history': answer_history,
+                        'children': []
+                    })
+                    latest = max(latest, end)
+
+            for _ in range(int(rng.expovariate(0.7))):
+                followup_time = minutes + rng.randrange(1, 2000)
+                followup = contribution(
+                    rng.choice(users),
+                    followup_time,
+                    type='followup',
+                    subject='<p>Followup</p>',
+                    children=[])
+                for _ in range(int(rng.expovariate(0.8))):
+                    followup_time += rng.randrange(1, 300)
+                    followup['children'].append(
+                        contribution(
+                            rng.choice(users),
+                            followup_time,
+                            type='feedback',
+                            subject='<p>Feedback</p>'))
+                post['children'].append(followup)
+                latest = max(latest, followup_time)
+
+            post['created'] = timestamp(minutes)
+            post['modified'] = timestamp(latest)
+            posts.append(post)
+
+        network = {
+            'nid': 'standin{:06d}'.format(seed),
+            'name': 'Synthetic Course',
+            'number': 'SYN {}'.format(num_posts),
+            'term': 'Fall 2018'
+        }
+        return Course(network, posts)
+
+
+def feed_item(post):
+    modified = post.get('modified')
+    if not modified:
+        modified = max(item['created'] for item in post['history'])
+    return {
+        'id': post['id'],
+        'nr': post.get('nr'),
+        'type': post['type'],
+        'subject': post['history'][0].get('subject', ''),
+        'modified': modified,
+        'updated': modified
+    }
+
+
+def record_course(crawl):
+    """
+    Builds a Course from the raw posts stored for a crawl, so it can be
+    saved and replayed later.
+    """
+    network = {
+        'nid': crawl.network.nid,
+        'name': crawl.network.name,
+        'number': crawl.network.number,
+        'term': crawl.network.term
+    }
+    posts = [
+        crawl_post.raw_post.post() for crawl_post in crawl.posts
+        if crawl_post.raw_post
+    ]
+    return Course(network, posts)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandinServer(object):
+    """
+    Serves a Course over HTTP the way Piazza would.
+
+    Every response is delayed by `latency` seconds (+/- 50%), a fraction
+    `error_rate` of API calls fail, and if `max_rate` is given, API calls
+    beyond that many per second are answered with a 429, like Piazza does
+    when it's being crawled too quickly.
+    """
+
+    def __init__(self,
+                 course,
+                 host='127.0.0.1',
+                 port=0,
+                 latency=0.0,
+                 error_rate=0.0,
+                 max_rate=None,
+                 seed=0):
+        self.course = course
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_rate = max_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent_calls = collections.deque()
+        self.stats = collections.Counter()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def delay(self):
+        if self.latency:
+            with self.lock:
+                jitter = self.rng.uniform(0.5, 1.5)
+            time.sleep(self.latency * jitter)
+
+    def admit(self):
+        """
+        Decides whether an API call should succeed, returning the HTTP
+        status and error message to respond with if it shouldn't.
+        """
+        with self.lock:
+            self.stats['calls'] += 1
+            now = time.monotonic()
+
+            if self.max_rate:
+                while self.recent_calls and now - self.recent_calls[0] > 1:
+                    self.recent_calls.popleft()
+                if len(self.recent_calls) >= self.max_rate:
+                    self.stats['throttled'] += 1
+                    return 429, 'Too many requests, please slow down.'
+                self.recent_calls.append(now)
+
+            if self.rng.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return 500, 'Internal server error.'
+
+        return 200, None
+
+    def call(self, method, params):
+        course = self.course
+        if method == 'user.login':
+            return 'OK'
+        elif method == 'user.status':
+            return {
+                'id': STANDIN_UID,
+                'networks': [{
+                    'id': course.network['nid'],
+                    'name': course.network['name'],
+                    'term': course.network['term'],
+                    'course_number': course.network['number'],
+                    'prof_hash': {
+                        STANDIN_UID: True
+                    }
+                }]
+            }
+        elif method == 'user_profile.get_profile':
+            return {
+                'user_id': STANDIN_UID,
+                'all_classes': {
+                    course.network['nid']: {
+                        'id': course.network['nid'],
+                        'name': course.network['name'],
+                        'term': course.network['term'],
+                        'num': course.network['number'],
+                        'is_ta': True
+                    }
+                }
+            }
+        elif method == 'network.get_my_feed':
+            offset = int(params.get('offset', 0))
+            limit = int(params.get('limit', 100))
+            return {
+                'feed': course.feed[offset:offset + limit],
+                'more': offset + limit < len(course.feed)
+            }
+        elif method == 'content.get':
+            post = course.posts.get(params.get('cid'))
+            if post is None:
+                raise KeyError('Content not found.')
+            return post
+        raise KeyError('Unknown method {}.'.format(method))
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def respond(self, status, body, content_type='application/json'):
+                data = body.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('Set-Cookie',
+                                 'session_id=standin; Path=/')
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                server.delay()
+                if urlparse(self.path).path == '/main/csrf_token':
+                    self.respond(200, 'CSRF_TOKEN="standin";',
+                                 'text/javascript')
+                else:
+                    self.respond(404, 'Not found', 'text/html')
+
+            def do_POST(self):
+                server.delay()
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length).decode('utf-8')
+
+                url = urlparse(self.path)
+                if url.path != '/logic/api':
+                    # the login form; any credentials are accepted
+                    self.respond(200, '<html></html>', 'text/html')
+                    return
+
+                status, error = server.admit()
+                if error:
+                    self.respond(status,
+                                 json.dumps({
+                                     'result': None,
+                                     'error': error
+                                 }))
+                    return
+
+                try:
+                    request = json.loads(body)
+                    method = request.get('method') or parse_qs(
+                        url.query)['method'][0]
+                    result = server.call(method, request.get('params', {}))
+                    response = {'result': result, 'error': None}
+                except (KeyError, ValueError) as e:
+                    response = {'result': None, 'error': str(e)}
+                self.respond(200, json.dumps(response))
+
+        return Handler
+
+
+def benchmark(course, rate, concurrency, **server_options):
+    """
+    Crawls every post of a course from an in-process stand-in with the
+    crawler's fetching code and reports the achieved throughput.
+    """
+    from .utils import RateLimiter, fetch_posts, make_piazza_rpc
+    import piazza_api
+
+    server = StandinServer(course, **server_options)
+    server.start()
+    try:
+        piazza_rpc = make_piazza_rpc(server.url)
+        piazza_rpc.user_login('bench@example.com', 'bench')
+        network = piazza_api.Piazza(piazza_rpc).network(course.network['nid'])
+
+        start = time.monotonic()
+        feed = network.get_feed(limit=999999, offset=0)
+        post_ids = [item['id'] for item in feed['feed']]
+
+        fetched = failed = 0
+        limiter = RateLimiter(rate, burst=concurrency)
+        for _, post, error in fetch_posts(network, post_ids, limiter,
+                                          concurrency):
+            if error:
+                failed += 1
+            else:
+                fetched += 1
+        elapsed = time.monotonic() - start
+    finally:
+        server.stop()
+
+    return {
+        'posts': len(post_ids),
+        'fetched': fetched,
+        'failed': failed,
+        'seconds': elapsed,
+        'posts_per_second': fetched / elapsed if elapsed else 0,
+        'calls': server.stats['calls'],
+        'throttled': server.stats['throttled'],
+        'errors': server.stats['errors']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve', help='run a stand-in')
+    bench_parser = subparsers.add_parser(
+        'bench', help='benchmark fetching posts from a stand-in')
+    generate_parser = subparsers.add_parser(
+        'generate', help='write a synthetic course dump')
+
+    for sub in [serve_parser, bench_parser, generate_parser]:
+        source = sub.add_mutually_exclusive_group(required=True)
+        source.add_argument('--dump', help='course dump to replay')
+        source.add_argument(
+            '--synthetic',
+            type=int,
+            metavar='POSTS',
+            help='generate a synthetic course with this many posts')
+        sub.add_argument('--seed', type=int, default=0)
+
+    for sub in [serve_parser, bench_parser]:
+        sub.add_argument(
+            '--latency',
+            type=float,
+            default=0.0,
+            help='mean response latency in seconds')
+        sub.add_argument(
+            '--error-rate',
+            type=float,
+            default=0.0,
+            help='fraction of API calls that fail')
+        sub.add_argument(
+            '--max-rate',
+            type=float,
+            default=None,
+            help='API calls per second allowed before answering with 429')
+
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8001)
+    bench_parser.add_argument(
+        '--rate', type=float, default=2.0, help='crawler rate limit')
+    bench_parser.add_argument(
+        '--concurrency', type=int, default=4, help='crawler concurrency')
+    generate_parser.add_argument('output', help='path to write the dump to')
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.error('a command is required')
+
+    if args.dump:
+        course = Course.from_dump(args.dump)
+    else:
+        course = Course.synthetic(args.synthetic, seed=args.seed)
+
+    if args.command == 'generate':
+        course.save(args.output)
+    elif args.command == 'serve':
+        server = StandinServer(
+            course,
+            host=args.host,
+            port=args.port,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            max_rate=args.max_rate,
+            seed=args.seed)
+        print('Serving {} ({} posts) on {}'.format(
+            course.network['nid'], len(course.posts), server.url))
+        server.serve_forever()
+    else:
+        results = benchmark(
+            course,
+            args.rate,
+            args.concurrency,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            max_rate=args.max_rate,
+            seed=args.seed)
+        for key, value in results.items():
+            print('{}: {}'.format(key, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,12 @@
-from celery import Celery, current_task
+from celery import Celery, chord, current_task
 from celery.result import AsyncResult
 from celery.utils.log import get_task_logger
 from datetime import datetime, timedelta
+from flask import current_app
 import functools
 import os
 import piazza_api
-import random
 import requests
-import time
 import traceback
 
 from .models import *
@@ -51,49 +50,321 @@ class throttle(object):
         return wrapper
 
 
-@celery.task(bind=True)
-def crawl_course(self, crawl_id, piazza_jar):
-    CRAWL_DELAY = 0.5
+def config_value(name, default):
+    value = current_app.config.get(name)
+    if value is None or value == '':
+        return default
+    return type(default)(value)
+
+
+def log_crawl_error(crawl, msg):
+    logger.error(msg)
+    error = CrawlError(crawl_id=crawl.id, message=msg)
+    crawl.errors.append(error)
+    db.session.add(error)
+
+
+def feed_item_modified(feed_item):
+    modified = feed_item.get('modified')
+    if not modified:
+        return None
+    return parse_timestamp(modified)
+
+
+def emit_crawl_progress(crawl, position):
+    total = crawl.total_posts
+    progress = min(100, 100 * float(position) / total) if total else 100
+    socketio.emit(
+        'progress', {'progress': progress},
+        namespace='/network',
+        room=crawl.network_id)
+    return progress
+
+
+def crawl_posts(crawl, network, feed_items, stored, limiter, concurrency,
+                report_progress):
+    """
+    Fetches the posts for the given feed items and creates their actions.
+    The feed items may be a stream; posts are fetched as their items
+    arrive.
+
+    `stored` maps the ids of posts this crawl has already processed to
+    their CrawlPost rows. Posts that haven't been modified since they were
+    stored are skipped, and the actions for the others are only replaced
+    if the post itself has changed.
+    """
+    ACTION_BATCH_SIZE = config_value('ACTION_BATCH_SIZE', 1000)
+
+    writer = ActionWriter(crawl, batch_size=ACTION_BATCH_SIZE)
+    modified = {}
+    # the content and raw posts that replaced actions and posts referred to,
+    # which may not be needed any more once the replacements are committed
+    old_content = set()
+    old_raw_posts = set()
+
+    def changed_post_ids():
+        for feed_item in feed_items:
+            post_id = feed_item['id']
+            modified[post_id] = feed_item_modified(feed_item)
+            if (post_id in stored
+                    and stored[post_id].modified == modified[post_id]):
+                writer.post_finished()
+                report_progress(writer.feed_position)
+                continue
+            yield post_id
+
+    posts = fetch_posts(network, changed_post_ids(), limiter, concurrency)
+    for post_id, post, error in posts:
+        if error:
+            log_crawl_error(crawl, ''.join(
+                traceback.format_exception(
+                    type(error), error, error.__traceback__)))
+        else:
+            try:
+                digest = RawPost.store(
+                    post, with_content=crawl.store_content)
+                if post_id not in stored:
+                    crawl.create_actions_from_post(writer, post)
+                elif stored[post_id].digest != digest:
+                    old_content.update(
+                        crawl.replace_post_actions(writer, post))
+                    old_raw_posts.add(stored[post_id].digest)
+                writer.add_post(post_id, modified[post_id], digest)
+            except Exception as e:
+                log_crawl_error(crawl, traceback.format_exc())
+        writer.post_finished()
+        report_progress(writer.feed_position)
+    writer.flush()
+
+    ActionContent.collect_garbage(old_content)
+    RawPost.collect_garbage(old_raw_posts)
+    db.session.commit()
+
+
+def delete_vanished_posts(crawl, stored, feed_ids):
+    old_content = set()
+    old_raw_posts = set()
+    for post_id in stored.keys() - feed_ids:
+        old_content.update(crawl.delete_post_actions(post_id))
+        old_raw_posts.add(stored[post_id].digest)
+        CrawlPost.query.filter_by(
+            crawl_id=crawl.id, post_id=post_id).delete()
+    ActionContent.collect_garbage(old_content)
+    RawPost.collect_garbage(old_raw_posts)
+    db.session.commit()
+
 
-    def sleep():
-        sleep_time = CRAWL_DELAY * random.uniform(0.5, 1.5)
-        time.sleep(sleep_time)
+def complete_crawl(crawl):
+    crawl.finished = True
+    db.session.commit()
+
+    socketio.emit(
+        'progress', {'progress': 100},
+        namespace='/network',
+        room=crawl.network_id)
+    socketio.emit('finished', {}, namespace='/network', room=crawl.network_id)
+
+    # every analysis of the crawl starts from a snapshot of its actions, so
+    # take it now rather than making the first analysis wait for it
+    crawl.snapshot()
+
+
+@celery.task(bind=True)
+def crawl_course(self, crawl_id, piazza_jar, incremental=False, resume=False):
+    # requests per second we're allowed to make to Piazza, and the maximum
+    # number of requests we'll have in flight at once
+    CRAWL_RATE = config_value('CRAWL_RATE', 2.0)
+    CRAWL_CONCURRENCY = config_value('CRAWL_CONCURRENCY', 4)
+    # number of workers to spread the crawl across; the shards split the
+    # rate and concurrency above between them, so together they never make
+    # more requests with this account than a single crawl would, which
+    # means there can't be more shards than requests allowed in flight
+    CRAWL_SHARDS = max(1, min(config_value('CRAWL_SHARDS', 1),
+                              CRAWL_CONCURRENCY))
 
     @throttle(timedelta(seconds=1))
-    def update_progress(current, total):
-        progress = 100 * float(current) / total
-        socketio.emit(
-            'progress', {'progress': progress},
-            namespace='/network',
-            room=crawl.network_id)
+    def update_progress(position):
+        progress = emit_crawl_progress(crawl, position)
         self.update_state(state='PROGRESS', meta={'progress': progress})
 
     crawl = Crawl.query.get(crawl_id)
+    if crawl.finished:
+        return
 
     piazza = piazza_from_cookie_dict(piazza_jar)
     network = piazza.network(crawl.network.nid)
-    feed = network.get_feed(limit=999999, offset=0)
+    limiter = RateLimiter(CRAWL_RATE, burst=CRAWL_CONCURRENCY)
+    feed = FeedReader(network, limiter)
+
+    # When crawling incrementally, only posts that are new or have been
+    # modified since the last crawl are fetched, and only their actions are
+    # replaced. Posts that have disappeared from the feed are removed.
+    #
+    # Resuming an interrupted crawl works the same way: every post in a
+    # committed batch was recorded along with its feed timestamp, so only
+    # the posts that were never committed (or have changed since) are
+    # fetched again.
+    stored = {}
+    if incremental or resume:
+        stored = {post.post_id: post for post in crawl.posts}
+
+    # posts that are skipped count towards the progress of the crawl, which
+    # is estimated from the first page of the feed until all of it has
+    # been read
+    crawl.feed_position = 0
+    crawl.total_posts = None
+    db.session.commit()
 
-    total_posts = len(feed['feed'])
-    for idx, feed_item in enumerate(feed['feed']):
-        sleep()
-        try:
-            post = network.get_post(feed_item['id'])
-            crawl.create_actions_from_post(post)
-        except Exception as e:
-            msg = traceback.format_exc()
-            logger.error(msg)
-            error = CrawlError(crawl_id=crawl.id, message=msg)
-            crawl.errors.append(error)
-            db.session.add(error)
-        db.session.commit()
-        update_progress(idx, total_posts)
-    update_progress(total_posts, total_posts, force=True)
+    def stream_feed():
+        pages_read = 0
+        for feed_item in feed:
+            if feed.pages_read != pages_read:
+                pages_read = feed.pages_read
+                if crawl.total_posts != feed.estimated_total:
+                    crawl.total_posts = feed.estimated_total
+                    db.session.commit()
+                    update_progress(crawl.feed_position, force=True)
+            yield feed_item
+
+    if CRAWL_SHARDS == 1:
+        crawl_posts(crawl, network, stream_feed(), stored, limiter,
+                    CRAWL_CONCURRENCY, update_progress)
+        delete_vanished_posts(crawl, stored, feed.seen)
+        crawl.total_posts = len(feed.seen)
+        complete_crawl(crawl)
+        return
+
+    # the shards each need to know which posts are theirs up front, so the
+    # whole feed has to be read before they can start
+    feed_items = []
+    for feed_item in feed:
+        post_id = feed_item['id']
+        if (post_id in stored and
+                stored[post_id].modified == feed_item_modified(feed_item)):
+            continue
+        feed_items.append({
+            'id': post_id,
+            'modified': feed_item.get('modified')
+        })
+    delete_vanished_posts(crawl, stored, feed.seen)
+
+    crawl.feed_position = len(feed.seen) - len(feed_items)
+    crawl.total_posts = len(feed.seen)
+    db.session.commit()
 
-    crawl.finished = True
+    if len(feed_items) > 1:
+        shard_size = -(-len(feed_items) // CRAWL_SHARDS)
+        rate = CRAWL_RATE / CRAWL_SHARDS
+        concurrency = CRAWL_CONCURRENCY // CRAWL_SHARDS
+
+        header = [
+            crawl_shard.si(crawl_id, piazza_jar,
+                           feed_items[i:i + shard_size], rate, concurrency)
+            for i in range(0, len(feed_items), shard_size)
+        ]
+        chord(header)(finish_crawl.si(crawl_id).on_error(
+            crawl_shard_failed.si(crawl_id)))
+        return
+
+    crawl_posts(crawl, network, feed_items, stored, limiter,
+                CRAWL_CONCURRENCY, update_progress)
+    complete_crawl(crawl)
+
+
+@celery.task
+def crawl_shard(crawl_id, piazza_jar, feed_items, rate, concurrency):
+    @throttle(timedelta(seconds=1))
+    def update_progress(position):
+        emit_crawl_progress(crawl, position)
+
+    crawl = Crawl.query.get(crawl_id)
+
+    piazza = piazza_from_cookie_dict(piazza_jar)
+    network = piazza.network(crawl.network.nid)
+
+    post_ids = [feed_item['id'] for feed_item in feed_items]
+    stored = CrawlPost.query.filter_by(crawl_id=crawl_id)\
+            .filter(CrawlPost.post_id.in_(post_ids))
+    stored = {post.post_id: post for post in stored}
+
+    limiter = RateLimiter(rate, burst=concurrency)
+    crawl_posts(crawl, network, feed_items, stored, limiter, concurrency,
+                update_progress)
+
+
+@celery.task
+def finish_crawl(crawl_id):
+    complete_crawl(Crawl.query.get(crawl_id))
+
+
+@celery.task
+def crawl_shard_failed(crawl_id):
+    # the chord never calls finish_crawl if a shard fails, which leaves the
+    # crawl unfinished; every post the other shards committed is kept, so
+    # it can be resumed from the crawl page
+    crawl = Crawl.query.get(crawl_id)
+    log_crawl_error(
+        crawl, "Part of the crawl failed before it could finish. Log in "
+        "again to resume the crawl; posts that were already crawled will "
+        "not be fetched again.")
     db.session.commit()
 
-    socketio.emit('finished', {}, namespace='/network', room=crawl.network_id)
+
+@celery.task
+def take_snapshot(crawl_id):
+    Crawl.query.get(crawl_id).snapshot()
+
+
+@celery.task(bind=True)
+def rebuild_actions(self, crawl_id):
+    """
+    Re-creates all of the actions for a crawl from the raw posts stored
+    when it was crawled, without contacting Piazza. The posts are split
+    into chunks that are processed in parallel by the available workers.
+    """
+    REBUILD_CHUNK_SIZE = 250
+
+    crawl = Crawl.query.get(crawl_id)
+    # content the rebuilt actions share with the old ones is stored again
+    # as the chunks write them
+    ActionContent.collect_garbage(crawl.clear_actions())
+
+    post_ids = [post.post_id for post in crawl.posts if post.digest]
+    crawl.feed_position = 0
+    crawl.total_posts = len(post_ids)
+    db.session.commit()
+
+    chunks = [
+        post_ids[i:i + REBUILD_CHUNK_SIZE]
+        for i in range(0, len(post_ids), REBUILD_CHUNK_SIZE)
+    ]
+
+    if not chunks:
+        finish_crawl.delay(crawl_id)
+        return
+
+    header = [rebuild_actions_chunk.si(crawl_id, chunk) for chunk in chunks]
+    chord(header)(finish_crawl.si(crawl_id))
+
+
+@celery.task
+def rebuild_actions_chunk(crawl_id, post_ids):
+    crawl = Crawl.query.get(crawl_id)
+    posts = CrawlPost.query.filter_by(crawl_id=crawl_id)\
+            .filter(CrawlPost.post_id.in_(post_ids))\
+            .options(db.joinedload(CrawlPost.raw_post)
+                     .undefer(RawPost.payload))
+
+    writer = ActionWriter(
+        crawl, batch_size=config_value('ACTION_BATCH_SIZE', 1000))
+    for crawl_post in posts:
+        try:
+            crawl.create_actions_from_post(writer, crawl_post.raw_post.post())
+        except Exception as e:
+            log_crawl_error(crawl, traceback.format_exc())
+        writer.post_finished()
+    writer.flush()
+    emit_crawl_progress(crawl, writer.feed_position)
 
 
 @celery.task(bind=True)
@@ -149,6 +420,14 @@ def run_analysis(self, analysis_id):
 
     model = analysis.run_sampler(
         training_data, progress_report=update_sampler_progress)
+    # a sampler that converged stopped before max_iter, so the report of
+    # its last iteration wasn't forced and may have been throttled away
+    if analysis.stop_iteration < analysis.max_iterations:
+        send_progress({
+            'sessions': 100,
+            'training_data': 100,
+            'sampling': 100
+        }, force=True)
 
     analysis.save_sampler_output(
         sessions, model, progress_report=update_saving_progress)
@@ -1,10 +1,46 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
 import requests
 import piazza_api
+import threading
+import time
 
+PIAZZA_ORIGIN = 'https://piazza.com'
 
-def piazza_from_cookie_dict(cookies):
+
+class RedirectAdapter(requests.adapters.HTTPAdapter):
+    """
+    Sends requests meant for Piazza to another server instead (see
+    roles.standin). The response still claims to be for the original
+    request so that cookies end up associated with piazza.com.
+    """
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base_url = base_url.rstrip('/')
+
+    def send(self, request, **kwargs):
+        redirected = request.copy()
+        redirected.url = self.base_url + request.url[len(PIAZZA_ORIGIN):]
+        response = super().send(redirected, **kwargs)
+        response.request = request
+        return response
+
+
+def make_piazza_rpc(base_url=None):
     piazza_rpc = piazza_api.rpc.PiazzaRPC()
 
+    # PIAZZA_URL points the app at a stand-in for Piazza, e.g. for
+    # benchmarking crawls without touching the real site
+    base_url = base_url or os.environ.get('PIAZZA_URL')
+    if base_url:
+        piazza_rpc.session.mount(PIAZZA_ORIGIN, RedirectAdapter(base_url))
+    return piazza_rpc
+
+
+def piazza_from_cookie_dict(cookies):
+    piazza_rpc = make_piazza_rpc()
+
     # HACK: The serialization of a CookieJar to a dict in requests drops
     # all additional cookie information like the domain. This is a problem
     # if a request asks for a cookie to be updated and grabs the wrong
@@ -24,3 +60,183 @@ def piazza_from_cookie_dict(cookies):
 
     piazza_rpc.session.cookies = jar
     return piazza_api.Piazza(piazza_rpc)
+
+
+class RateLimiter(object):
+    """
+    A thread-safe token bucket used to limit the rate of requests we make
+    to Piazza.
+
+    The refill rate adapts to how Piazza is responding: every failed
+    request (including being told to slow down with a 429) halves the
+    rate and empties the bucket, and every successful request slowly
+    increases the rate again until it is back at the configured maximum.
+    """
+
+    def __init__(self, rate, burst=1, min_rate=0.1):
+        self.max_rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.rate = self.max_rate
+        self.capacity = float(burst)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def backoff(self):
+        with self.lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            # force everyone to wait at least one full period at the new
+            # rate before the next request goes out
+            self.tokens = min(self.tokens, 0)
+
+    def recover(self):
+        with self.lock:
+            self._refill()
+            self.rate = min(self.max_rate,
+                            self.rate + 0.05 * self.max_rate)
+
+
+def fetch_posts(network, post_ids, limiter, concurrency=1, retries=3):
+    """
+    Fetches the posts with the given ids from a piazza_api Network using a
+    bounded pool of worker threads, each of which must acquire a token
+    from the limiter before making a request.
+
+    This is a generator yielding (post_id, post, error) tuples in the
+    order the requests complete, so the caller can process posts while
+    the remaining requests are still in flight. Failed requests are
+    retried up to `retries` times; if every attempt fails, post will be
+    None and error will be the last exception raised.
+    """
+
+    def fetch(post_id):
+        for attempt in range(retries + 1):
+            limiter.acquire()
+            try:
+                post = network.get_post(post_id)
+            except Exception:
+                limiter.backoff()
+                if attempt == retries:
+                    raise
+            else:
+                limiter.recover()
+                return post
+
+    post_ids = iter(post_ids)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = {}
+
+        def submit_next():
+            for post_id in post_ids:
+                pending[pool.submit(fetch, post_id)] = post_id
+                return
+
+        # keep a couple of requests queued per thread so the workers never
+        # sit idle while we're busy processing results
+        for _ in range(2 * concurrency):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                post_id = pending.pop(future)
+                submit_next()
+                error = future.exception()
+                if error:
+                    yield post_id, None, error
+                else:
+                    yield post_id, future.result(), None
+
+
+class FeedReader(object):
+    """
+    Iterates over the items in a network's feed, requesting it from Piazza
+    one page at a time (each page acquiring a token from the limiter) so
+    that posts can be fetched as soon as the first page arrives. Failed
+    requests for a page are retried up to `retries` times.
+
+    The feed is ordered by when posts were last active, so posts can move
+    to the front of it while we're still paging through. Items that show
+    up twice are only yielded once, and once the end of the feed is
+    reached it is read again from the start until a page turns up nothing
+    new, picking up posts that moved in front of the pages already read.
+    """
+
+    def __init__(self, network, limiter, page_size=100, retries=3):
+        self.network = network
+        self.limiter = limiter
+        self.page_size = page_size
+        self.retries = retries
+        self.seen = set()
+        self.pages_read = 0
+        self.first_page_estimate = None
+
+    @property
+    def estimated_total(self):
+        """
+        The number of posts in the feed, estimated from the largest post
+        number on the first page until the whole feed has been read.
+        """
+        return max(self.first_page_estimate or 0, len(self.seen))
+
+    def get_page(self, offset):
+        # failed requests are retried and slow the limiter down just like
+        # the ones made by fetch_posts
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            try:
+                feed = self.network.get_feed(
+                    limit=self.page_size, offset=offset)
+            except Exception:
+                self.limiter.backoff()
+                if attempt == self.retries:
+                    raise
+            else:
+                self.limiter.recover()
+                break
+        self.pages_read += 1
+
+        items = feed.get('feed', [])
+        if self.first_page_estimate is None:
+            numbers = [item['nr'] for item in items if item.get('nr')]
+            self.first_page_estimate = max(numbers or [len(items)])
+        return items
+
+    def read_pages(self, catch_up=False):
+        offset = 0
+        while True:
+            items = self.get_page(offset)
+            new_items = [
+                item for item in items if item['id'] not in self.seen
+            ]
+            for item in new_items:
+                self.seen.add(item['id'])
+                yield item
+
+            if len(items) < self.page_size or (catch_up and not new_items):
+                return
+            offset += len(items)
+
+    def __iter__(self):
+        for item in self.read_pages():
+            yield item
+        if self.pages_read > 1:
+            for item in self.read_pages(catch_up=True):
+                yield item
@@ -26,12 +26,7 @@ def network_subscribe(data):
     join_room(network_id)
 
     if net.crawl:
-        if net.crawl.finished:
-            emit('progress', {'progress': 100}, room=network_id)
-        else:
-            result = AsyncResult(net.crawl.task_id)
-            if result.state == 'PROGRESS':
-                emit('progress', result.info, room=network_id)
+        emit('progress', {'progress': net.crawl.progress()}, room=network_id)
 
 @socketio.on('subscribe', namespace='/analysis')
 def analysis_subscribe(data):
@@ -0,0 +1,19 @@
+import unittest
+
+from roles.forms import MAX_SWEEP_GAPS, parse_session_gaps
+
+
+class ParseSessionGapsTest(unittest.TestCase):
+    def test_valid(self):
+        self.assertEqual(parse_session_gaps('0.5, 1,2 ,24,'), [0.5, 1, 2, 24])
+
+    def test_invalid(self):
+        for text in ['1, x', '1, -2', '0', 'inf', 'nan', '', ' , ']:
+            with self.assertRaises(ValueError, msg=text):
+                parse_session_gaps(text)
+
+    def test_too_many(self):
+        gaps = ', '.join(['1'] * MAX_SWEEP_GAPS)
+        self.assertEqual(len(parse_session_gaps(gaps)), MAX_SWEEP_GAPS)
+        with self.assertRaises(ValueError):
+            parse_session_gaps(gaps + ', 2')
@@ -0,0 +1,231 @@
+import collections
+from datetime import datetime
+import json
+import unittest
+from unittest import mock
+
+from sqlalchemy.dialects import postgresql
+
+from roles.models import (ActionType, CrawlUser, classify_post, db,
+                          parse_timestamp, strip_post_content)
+from roles.standin import Course
+
+
+def classify_post_slowly(post):
+    """
+    Finds the actions in a post the straightforward way, by asking the
+    ActionType classmethods about every contribution to it.
+    """
+    actions = []
+    num_fully_anon = 0
+
+    def created(item):
+        return datetime.strptime(item['created'], '%Y-%m-%dT%H:%M:%SZ')
+
+    def add_history(child):
+        nonlocal num_fully_anon
+        for idx, item in enumerate(reversed(child['history'])):
+            try:
+                action_type = ActionType.from_post_history(
+                    post, child, item, is_edit=(idx != 0))
+            except KeyError as e:
+                if e.args[0] != 'uid':
+                    raise
+                num_fully_anon += 1
+                continue
+            if item['subject']:
+                content = "\n".join([item['subject'], item['content']])
+            else:
+                content = item['content']
+            actions.append((post['id'], item['uid'], int(action_type),
+                            created(item), content))
+
+    def add_followup(followup):
+        nonlocal num_fully_anon
+        try:
+            action_type = ActionType.followup_action_type(post, followup)
+            actions.append((post['id'], followup['uid'], int(action_type),
+                            created(followup), followup['subject']))
+        except KeyError as e:
+            if e.args[0] != 'uid':
+                raise
+            num_fully_anon += 1
+
+        for feedback in followup['children']:
+            try:
+                action_type = ActionType.feedback_action_type(
+                    post, followup, feedback)
+            except KeyError as e:
+                if e.args[0] != 'uid':
+                    raise
+                num_fully_anon += 1
+                continue
+            actions.append((post['id'], feedback['uid'], int(action_type),
+                            created(followup), feedback['subject']))
+
+    add_history(post)
+    for child in post['children']:
+        if child['type'] == 'i_answer' or child['type'] == 's_answer':
+            add_history(child)
+        else:
+            add_followup(child)
+    return actions, num_fully_anon
+
+
+def as_tuples(actions):
+    return list(
+        zip(actions.post_id, actions.uid, actions.type_id, actions.time,
+            actions.content))
+
+
+class ClassifyPostTest(unittest.TestCase):
+    def setUp(self):
+        self.posts = list(Course.synthetic(500, seed=3).posts.values())
+        # make some of the posts fully anonymous at the root, which makes
+        # everything in them count as fully anonymous
+        for post in self.posts[::37]:
+            post['history'][-1].pop('uid', None)
+
+    def test_matches_action_type_classmethods(self):
+        total_fully_anon = 0
+        for post in self.posts:
+            expected, num_fully_anon = classify_post_slowly(post)
+            actions = classify_post(post)
+            self.assertEqual(as_tuples(actions), expected, post['id'])
+            self.assertEqual(actions.num_fully_anon, num_fully_anon,
+                             post['id'])
+            total_fully_anon += num_fully_anon
+        # make sure the fully anonymous paths were exercised
+        self.assertGreater(total_fully_anon, 0)
+
+    def test_appends_to_existing_actions(self):
+        actions = None
+        expected = []
+        for post in self.posts[:20]:
+            actions = classify_post(post, actions)
+            expected.extend(classify_post_slowly(post)[0])
+        self.assertEqual(as_tuples(actions), expected)
+
+    def test_without_content(self):
+        for post in self.posts[:20]:
+            with_content = classify_post(post)
+            without_content = classify_post(post, with_content=False)
+            self.assertEqual(without_content.content,
+                             [None] * len(with_content))
+            self.assertEqual(without_content.type_id, with_content.type_id)
+            self.assertEqual(without_content.time, with_content.time)
+
+    def test_select(self):
+        actions = classify_post(self.posts[1])
+        for post in self.posts[2:10]:
+            classify_post(post, actions)
+        indices = list(range(0, len(actions), 3))
+        self.assertEqual(
+            as_tuples(actions.select(indices)),
+            [as_tuples(actions)[i] for i in indices])
+
+    def test_invalid_post_type(self):
+        post = self.posts[0]
+        post['type'] = 'unknown'
+        post['history'][-1]['uid'] = 'someone'
+        with self.assertRaises(Exception):
+            classify_post(post)
+
+
+class StripPostContentTest(unittest.TestCase):
+    def test_keeps_actions_without_content(self):
+        for post in Course.synthetic(100, seed=4).posts.values():
+            original = json.dumps(post, sort_keys=True)
+            stripped = strip_post_content(post)
+            self.assertEqual(json.dumps(post, sort_keys=True), original)
+
+            text = json.dumps(stripped)
+            for fragment in ['Subject', 'Content', 'Followup', 'Feedback']:
+                self.assertNotIn(fragment, text)
+            self.assertEqual(
+                as_tuples(classify_post(stripped, with_content=False)),
+                as_tuples(classify_post(post, with_content=False)))
+
+
+class FakeCrawlUserSession(object):
+    """
+    Stands in for the database session used by CrawlUser.intern: each
+    INSERT adds the uids not in the table yet, and the query that follows
+    it finds the ids of the uids it inserted.
+    """
+
+    def __init__(self, existing):
+        self.ids = dict(existing)
+        self.inserts = []
+
+    def execute(self, stmt):
+        params = stmt.compile(dialect=postgresql.dialect()).params
+        uids = [params['uid_m{}'.format(i)] for i in range(len(params) // 2)]
+        self.inserts.append(uids)
+        for uid in uids:
+            self.ids.setdefault(uid, len(self.ids) + 1)
+
+    def query(self, *columns):
+        return FakeCrawlUserQuery(
+            [(uid, self.ids[uid]) for uid in self.inserts[-1]])
+
+
+class FakeCrawlUserQuery(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def filter(self, *criteria):
+        return self
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class CrawlUserInternTest(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeCrawlUserSession({'carol': 1})
+        patcher = mock.patch.object(db, 'session', self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_numbers_new_users_in_uid_order(self):
+        ids = CrawlUser.intern(1, ['dave', 'bob', 'carol', 'bob', 'alice'])
+        self.assertEqual(self.session.inserts,
+                         [['alice', 'bob', 'carol', 'dave']])
+        # carol was already in the table and keeps the same id
+        self.assertEqual(ids, [4, 3, 1, 3, 2])
+
+    def test_inserts_in_batches(self):
+        uids = ['user{}'.format(i) for i in range(7)]
+        CrawlUser.intern(1, uids, batch_size=3)
+        self.assertEqual(self.session.inserts,
+                         [uids[0:3], uids[3:6], uids[6:7]])
+
+    def test_known_ids_are_not_looked_up(self):
+        known = {'bob': 5}
+        ids = CrawlUser.intern(1, ['bob', 'alice'], known=known)
+        self.assertEqual(self.session.inserts, [['alice']])
+        self.assertEqual(ids, [5, 2])
+        self.assertEqual(known, {'bob': 5, 'alice': 2})
+
+    def test_known_chain_keeps_new_ids_apart(self):
+        # how ActionWriter keeps the ids of a batch out of its cache until
+        # the batch has committed
+        cache = {'bob': 5}
+        known = collections.ChainMap({}, cache)
+        CrawlUser.intern(1, ['bob', 'alice'], known=known)
+        self.assertEqual(cache, {'bob': 5})
+        self.assertEqual(known.maps[0], {'alice': 2})
+
+
+class ParseTimestampTest(unittest.TestCase):
+    def test_piazza_format(self):
+        self.assertEqual(
+            parse_timestamp('2018-09-04T17:21:05Z'),
+            datetime(2018, 9, 4, 17, 21, 5))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_timestamp('2018-13-04T17:21:05Z')
+        with self.assertRaises(ValueError):
+            parse_timestamp('yesterday')
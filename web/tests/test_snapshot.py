@@ -0,0 +1,151 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from roles.snapshot import ActionSnapshot
+
+
+def make_rows(num_users=40, max_actions=60, seed=0):
+    """
+    Random (user_id, epoch seconds, type_id, action_id) rows ordered by
+    user and time, with the gaps between actions spread from seconds to
+    days so that every session gap splits them differently.
+    """
+    rng = random.Random(seed)
+    rows = []
+    action_id = 0
+    user_ids = rng.sample(range(1, 10 * num_users), num_users)
+    for user_id in sorted(user_ids):
+        time = 1535328000 + rng.randrange(86400)
+        for _ in range(rng.randrange(1, max_actions)):
+            time += int(rng.choice([0, 1, 60, 3600, 86400]) * rng.random())
+            action_id += 1
+            rows.append((user_id, time, rng.randrange(1, 36), action_id))
+    return rows
+
+
+def sessionize_slowly(rows, session_gap):
+    """
+    Splits the rows into sessions one action at a time, returning the
+    (user_id, [action_id, ...]) of every session.
+    """
+    sessions = []
+    last_user = last_time = None
+    for user_id, time, _, action_id in rows:
+        if user_id != last_user or time - last_time > session_gap * 3600:
+            sessions.append((user_id, []))
+        sessions[-1][1].append(action_id)
+        last_user, last_time = user_id, time
+    return sessions
+
+
+class ActionSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.rows = make_rows()
+
+    def build(self, rows, name='crawl-1.a', **kwargs):
+        return ActionSnapshot.build(
+            os.path.join(self.directory, name), iter(rows), **kwargs)
+
+    def test_build_and_load(self):
+        snapshot = self.build(self.rows)
+        loaded = ActionSnapshot.load(snapshot.path)
+        for found in [snapshot, loaded]:
+            self.assertEqual(len(found), len(self.rows))
+            self.assertEqual(found.user_ids,
+                             sorted({row[0] for row in self.rows}))
+            self.assertEqual(
+                list(
+                    zip(
+                        np.asarray(found.user_ids)[found.user].tolist(),
+                        found.time.tolist(), found.type_id.tolist(),
+                        found.action_id.tolist())), self.rows)
+
+    def test_chunks_match_single_chunk(self):
+        whole = self.build(self.rows, name='crawl-1.a')
+        # small chunks, so users are split across them
+        chunked = self.build(self.rows, name='crawl-2.a', chunk_size=7)
+        self.assertEqual(chunked.user_ids, whole.user_ids)
+        for name in ['user', 'time', 'type_id', 'action_id']:
+            np.testing.assert_array_equal(
+                getattr(chunked, name), getattr(whole, name))
+
+    def test_empty(self):
+        snapshot = self.build([])
+        self.assertEqual(len(snapshot), 0)
+        self.assertEqual(snapshot.user_ids, [])
+        self.assertEqual(len(snapshot.sessions(1)), 0)
+        self.assertIsNone(snapshot.sweep([1])[0].avg)
+
+    def test_replaces_stale_snapshots(self):
+        old = self.build(self.rows[:10], name='crawl-1.a')
+        new = self.build(self.rows, name='crawl-1.b')
+        self.assertFalse(os.path.exists(old.path))
+        self.assertEqual(len(ActionSnapshot.load(new.path)), len(self.rows))
+
+    def test_gaps(self):
+        snapshot = self.build(self.rows)
+        expected = [np.inf]
+        for previous, row in zip(self.rows, self.rows[1:]):
+            if row[0] != previous[0]:
+                expected.append(np.inf)
+            else:
+                expected.append(row[1] - previous[1])
+        np.testing.assert_array_equal(snapshot.gaps(), expected)
+
+    def test_sessions_match_sessionizing_one_action_at_a_time(self):
+        snapshot = self.build(self.rows)
+        for session_gap in [0, 0.01, 0.5, 1, 6, 24, 1000]:
+            expected = sessionize_slowly(self.rows, session_gap)
+            sessions = snapshot.sessions(session_gap)
+            found = [
+                (snapshot.user_ids[user],
+                 snapshot.action_id[start:end].tolist())
+                for user, start, end in zip(sessions.users, sessions.starts,
+                                            sessions.ends)
+            ]
+            self.assertEqual(found, expected, session_gap)
+
+    def test_sweep(self):
+        snapshot = self.build(self.rows)
+        summaries = snapshot.sweep([6, 1, 24, 1])
+        self.assertEqual([summary.session_gap for summary in summaries],
+                         [1, 6, 24])
+        for summary in summaries:
+            lengths = [
+                len(actions) for _, actions in sessionize_slowly(
+                    self.rows, summary.session_gap)
+            ]
+            self.assertEqual(summary.sessions, len(lengths))
+            self.assertAlmostEqual(summary.avg, np.mean(lengths))
+            self.assertAlmostEqual(summary.std, np.std(lengths))
+            self.assertEqual(summary.median, np.median(lengths))
+            self.assertEqual(summary.max, max(lengths))
+
+    def test_training_data(self):
+        snapshot = self.build(self.rows)
+        sessions = snapshot.sessions(1)
+        training = sessions.training_data(35)
+        self.assertEqual(len(training.user_offsets),
+                         len(snapshot.user_ids) + 1)
+        self.assertEqual(len(training.session_offsets), len(sessions) + 1)
+        self.assertEqual(int(training.counts.sum()), len(self.rows))
+
+        # the histogram of every session matches its actions
+        type_ids = {row[3]: row[2] for row in self.rows}
+        for s, (_, actions) in enumerate(sessionize_slowly(self.rows, 1)):
+            begin, end = training.session_offsets[s:s + 2]
+            histogram = dict(
+                zip((training.action_ids[begin:end] + 1).tolist(),
+                    training.counts[begin:end].tolist()))
+            expected = {}
+            for action_id in actions:
+                type_id = type_ids[action_id]
+                expected[type_id] = expected.get(type_id, 0) + 1
+            self.assertEqual(histogram, expected)
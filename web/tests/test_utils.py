@@ -0,0 +1,95 @@
+import unittest
+from unittest import mock
+
+from roles.utils import FeedReader, RateLimiter
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.multiple(
+            'roles.utils.time',
+            monotonic=self.clock.monotonic,
+            sleep=self.clock.sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_then_rate(self):
+        limiter = RateLimiter(2.0, burst=3)
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+
+        limiter.acquire()
+        self.assertAlmostEqual(sum(self.clock.sleeps), 0.5)
+
+    def test_backoff_halves_rate_down_to_minimum(self):
+        limiter = RateLimiter(1.0, burst=2, min_rate=0.3)
+        limiter.backoff()
+        self.assertEqual(limiter.rate, 0.5)
+        limiter.backoff()
+        self.assertEqual(limiter.rate, 0.3)
+
+    def test_backoff_empties_bucket(self):
+        limiter = RateLimiter(2.0, burst=4)
+        limiter.backoff()
+        limiter.acquire()
+        # a full period at the halved rate
+        self.assertAlmostEqual(sum(self.clock.sleeps), 1.0)
+
+    def test_recover_returns_to_max_rate(self):
+        limiter = RateLimiter(2.0)
+        limiter.backoff()
+        for _ in range(100):
+            limiter.recover()
+        self.assertEqual(limiter.rate, 2.0)
+
+
+class FlakyNetwork(object):
+    def __init__(self, num_items, failures):
+        self.items = [{'id': str(i), 'nr': i + 1} for i in range(num_items)]
+        self.failures = failures
+        self.calls = 0
+
+    def get_feed(self, limit, offset):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('Piazza is unavailable')
+        return {'feed': self.items[offset:offset + limit]}
+
+
+class FeedReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.limiter = mock.Mock(spec=RateLimiter)
+
+    def test_retries_failed_pages(self):
+        network = FlakyNetwork(5, failures=2)
+        feed = FeedReader(network, self.limiter, page_size=10)
+        self.assertEqual([item['id'] for item in feed],
+                         ['0', '1', '2', '3', '4'])
+        self.assertEqual(network.calls, 3)
+        self.assertEqual(self.limiter.acquire.call_count, 3)
+        self.assertEqual(self.limiter.backoff.call_count, 2)
+        self.assertEqual(self.limiter.recover.call_count, 1)
+
+    def test_gives_up_after_retries(self):
+        network = FlakyNetwork(5, failures=3)
+        feed = FeedReader(network, self.limiter, page_size=10, retries=2)
+        with self.assertRaises(RuntimeError):
+            list(feed)
+        self.assertEqual(network.calls, 3)
+        self.assertEqual(self.limiter.backoff.call_count, 3)